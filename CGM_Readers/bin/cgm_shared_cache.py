@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+"""
+Manage a shared-memory cache of CGM InSAR tracks for pre-forked serving processes.
+load: read an HDF5 file into named shared-memory blocks (workers then call cgm_shared_cache.attach_track_cache)
+status: print what a cache holds and how many workers are attached
+cleanup: remove a cache's shared-memory blocks
+"""
+
+import argparse
+import cgm_library
+
+
+def welcome_and_parse_runstring():
+    print("\nManage a shared-memory cache of SCEC InSAR HDF5 tracks. ");
+    parser = argparse.ArgumentParser(description='Load, inspect, or remove a shared-memory track cache. ',
+                                     epilog='\U0001f600 \U0001f600 \U0001f600 ');
+    parser.add_argument('action', type=str, choices=['load', 'status', 'cleanup'], help='what to do. Required.')
+    parser.add_argument('prefix', type=str, help='name of the cache. Required.')
+    parser.add_argument('--hdf5_file', type=str, default=None, help='HDF5 file to load (for load)')
+    parser.add_argument('--time_series', action='store_true', help='also share time series slices (for load)')
+    parser.add_argument('--force', action='store_true', help='remove even if workers are still attached (cleanup)')
+    args = parser.parse_args()
+    return args;
+
+
+if __name__ == "__main__":
+    args = welcome_and_parse_runstring();
+    if args.action == 'load':
+        cgm_library.cgm_shared_cache.load_track_cache(args.hdf5_file, args.prefix, args.time_series);
+    elif args.action == 'status':
+        print(cgm_library.cgm_shared_cache.get_cache_status(args.prefix));
+    else:
+        cgm_library.cgm_shared_cache.cleanup_track_cache(args.prefix, args.force);
@@ -1,5 +1,20 @@
-from . import cgm_packaging_functions
-from . import io_cgm_hdf5
-from . import io_cgm_configs
-from . import hdf5_to_geocsv
-from . import cgm_to_mintpy
+"""
+Submodules are imported on first use (cgm_library.io_cgm_hdf5, ...), so that light tasks such as writing empty
+configs or starting the command line tool don't pay for importing h5py and netCDF4.
+"""
+
+import importlib
+
+SUBMODULES = ["cgm_packaging_functions", "io_cgm_hdf5", "io_cgm_configs", "hdf5_to_geocsv", "cgm_to_mintpy",
+              "cgm_overviews", "cgm_valid_data", "cgm_sampling", "cgm_async", "cgm_quantization", "cgm_shared_cache",
+              "cgm_zarr_store", "cgm_to_gmt", "cgm_cli", "cgm_timeseries"];
+
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        return importlib.import_module("." + name, __name__);
+    raise AttributeError("module %s has no attribute %s" % (__name__, name));
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + SUBMODULES);
@@ -0,0 +1,165 @@
+"""
+Asyncio-friendly queries of CGM InSAR HDF5 files, for web backends running an event loop.
+The blocking readers and extractors of io_cgm_hdf5 and hdf5_to_geocsv run in a bounded thread pool.
+Files are opened lazily (read_cgm_hdf5_full_data(..., lazy=True)), so a query reads only the pixels it needs.
+Concurrent requests for the same file share one in-flight open, and recently used files stay open in a small cache.
+Only the open is shared: concurrent queries that touch the same track or chunk each read their own pixels (chunked
+stores keep recently used chunks cached, but two queries that miss at once both read the chunk).
+Every query accepts a timeout, and can be cancelled like any other coroutine.
+
+Example:
+    queries = CGMAsyncQueries(max_workers=4, timeout=30);
+    velocity_list = await queries.get_velocities("D071.hdf5", [[-118.2437, 34.0522]]);
+    queries.close();
+"""
+
+import asyncio
+import os
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from . import io_cgm_hdf5
+from . import hdf5_to_geocsv
+
+
+class CGMAsyncQueries:
+    """
+    Holds the thread pool, the table of in-flight file opens, and the cache of open files. Use one instance per
+    event loop.
+    """
+
+    def __init__(self, max_workers=4, timeout=None, cache_size=8):
+        """
+        :param max_workers: int, maximum number of blocking reads/extractions running at once
+        :param timeout: float, default timeout in seconds for each query (None for no timeout)
+        :param cache_size: int, number of recently used files kept open
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers);
+        self.timeout = timeout;
+        self.cache_size = cache_size;
+        self.inflight_reads = {};  # (hdf_file, mtime) -> asyncio future of the lazy cgm_data_structure
+        self.file_cache = OrderedDict();  # hdf_file -> (mtime, lazy cgm_data_structure), least recently used first
+
+    async def __aenter__(self):
+        return self;
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close();
+
+    def close(self):
+        """Shut down the thread pool without waiting for reads that nobody awaits anymore."""
+        self.executor.shutdown(wait=False);
+        return;
+
+    async def run_blocking(self, function, *args):
+        """Run a blocking function in the bounded thread pool."""
+        loop = asyncio.get_running_loop();
+        return await loop.run_in_executor(self.executor, function, *args);
+
+    async def read_file(self, hdf_file):
+        """
+        Open a CGM product lazily: lon, lat, and the valid-data mask are read, and grids are read later, only where
+        queries index them. One open is shared between all concurrent callers for the same file, and the result is
+        cached until the file is modified (or drops out of the cache). Cancelling one caller doesn't cancel the open
+        for the others. The grid reads of the queries themselves are not merged.
+
+        :param hdf_file: name of SCEC HDF5 File (or chunked directory store)
+        :return: cgm_data_structure, a list of track dictionaries with LazyGrid grids
+        """
+        mtime = os.path.getmtime(hdf_file);
+        if hdf_file in self.file_cache and self.file_cache[hdf_file][0] == mtime:
+            self.file_cache.move_to_end(hdf_file);
+            return self.file_cache[hdf_file][1];
+        key = (hdf_file, mtime);
+        if key not in self.inflight_reads:
+            loop = asyncio.get_running_loop();
+            future = loop.run_in_executor(self.executor, lambda: io_cgm_hdf5.read_cgm_hdf5_full_data(
+                hdf_file, lazy=True, include_uncertainties=True));
+            self.inflight_reads[key] = future;
+            future.add_done_callback(lambda done: self.finish_read(key, done));
+        return await asyncio.shield(self.inflight_reads[key]);
+
+    def finish_read(self, key, future):
+        """Done-callback of a file open (runs in the event loop): cache the result, evicting the oldest file."""
+        self.inflight_reads.pop(key, None);
+        if future.cancelled() or future.exception() is not None:
+            return;
+        self.file_cache[key[0]] = (key[1], future.result());
+        self.file_cache.move_to_end(key[0]);
+        if len(self.file_cache) > self.cache_size:
+            self.file_cache.popitem(last=False);
+        return;
+
+    async def with_timeout(self, coroutine, timeout):
+        """Await a query, raising asyncio.TimeoutError after timeout seconds (or the instance default)."""
+        timeout = self.timeout if timeout is None else timeout;
+        return await asyncio.wait_for(coroutine, timeout);
+
+    async def get_velocities(self, hdf_file, pixel_list, timeout=None, **kwargs):
+        """
+        Velocity lookup, like hdf5_to_geocsv.extract_vel_from_file.
+
+        :param hdf_file: name of SCEC HDF5 File
+        :param pixel_list: list of structures [lon, lat]
+        :param timeout: float, seconds (defaults to the instance timeout)
+        :param kwargs: passed to hdf5_to_geocsv.extract_vel_from_cgm_data_structure (snap_pixels, method, footprint)
+        :returns: velocity_list, ex: [lon, lat, 0.0, [lkvENU], 'D071', nan]
+        """
+        async def query():
+            cgm_data_structure = await self.read_file(hdf_file);
+            return await self.run_blocking(lambda: hdf5_to_geocsv.extract_vel_from_cgm_data_structure(
+                cgm_data_structure, pixel_list, **kwargs));
+        return await self.with_timeout(query(), timeout);
+
+    async def get_time_series(self, hdf_file, pixel_list, output_dir, timeout=None, **kwargs):
+        """
+        Time series lookup written to GeoCSV, like hdf5_to_geocsv.extract_csv_from_file.
+
+        :param hdf_file: name of SCEC HDF5 File
+        :param pixel_list: list of structures [lon, lat]
+        :param output_dir: directory where pixels' GeoCSVs will live
+        :param timeout: float, seconds (defaults to the instance timeout)
+        :param kwargs: passed to hdf5_to_geocsv.extract_csv_from_cgm_data_structure (snap_pixels, method, footprint)
+        :returns: a list of pixel structures of metadata [lon, lat, vel, lkv, track, vel_unc]
+        """
+        async def query():
+            cgm_data_structure = await self.read_file(hdf_file);
+            return await self.run_blocking(lambda: hdf5_to_geocsv.extract_csv_from_cgm_data_structure(
+                cgm_data_structure, pixel_list, output_dir, **kwargs));
+        return await self.with_timeout(query(), timeout);
+
+    async def export_bounding_box(self, hdf_file, bounding_box, output_dir, output_format="csv", timeout=None):
+        """
+        Bounding-box velocity export, like hdf5_to_geocsv.velocities_to_csv and velocities_to_json.
+
+        :param hdf_file: name of SCEC HDF5 File
+        :param bounding_box: [W, E, S, N] in longitude and latitude
+        :param output_dir: string
+        :param output_format: 'csv' or 'json'
+        :param timeout: float, seconds (defaults to the instance timeout)
+        :returns: bounding box metadata [W, E, S, N, nx, ny]
+        """
+        async def query():
+            cgm_data_structure = await self.read_file(hdf_file);
+            return await self.run_blocking(export_velocities_in_box, cgm_data_structure, bounding_box, output_dir,
+                                           output_format);
+        return await self.with_timeout(query(), timeout);
+
+
+def export_velocities_in_box(cgm_data_structure, bounding_box, output_dir, output_format="csv"):
+    """
+    Blocking part of export_bounding_box, on an already-opened cgm_data_structure.
+    A bounding box touches many pixels, so the velocity and look vector grids are read whole, once, for the export.
+    """
+    velocity_grids = ["velocities", "velo_unc", "lkv_E", "lkv_N", "lkv_U"];
+    cgm_data_structure = [{**track_dict, **dict([(key, np.asarray(track_dict[key])) for key in velocity_grids
+                                                 if key in track_dict])} for track_dict in cgm_data_structure];
+    pixel_list, bounding_box_metadata = hdf5_to_geocsv.unpack_bounding_box(
+        bounding_box, lon_array=cgm_data_structure[0]["lon"], lat_array=cgm_data_structure[0]["lat"]);
+    velocity_list = hdf5_to_geocsv.extract_vel_from_cgm_data_structure(cgm_data_structure, pixel_list,
+                                                                       keep_invalid=True);
+    if output_format == "json":
+        hdf5_to_geocsv.write_vels_to_json(velocity_list, output_dir);
+    else:
+        hdf5_to_geocsv.write_vels_to_csv(velocity_list, output_dir);
+    return bounding_box_metadata;
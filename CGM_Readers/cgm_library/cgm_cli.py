@@ -0,0 +1,193 @@
+"""
+Single command line tool for CGM InSAR products, installed as 'cgm'. Subcommands:
+    package          write HDF5 files from local grids and a file_level_config
+    empty-configs    write empty file_level_config and track_metadata_config templates
+    inspect          print product metadata, grid shapes, and time series dates (reads no grids)
+    extract-vels     velocities and look vectors at pixels, from one or several files
+    extract-ts       GeoCSV time series at pixels, from one or several files
+    export-csv       velocities in a bounding box, to velocity_list.csv
+    export-json      velocities in a bounding box, to velocity_list.json
+    export-gmt       grids back to pixel-node-registered GMT NetCDF files
+    export-zarr      product to a chunked directory store
+    to-mintpy        pseudo-MintPy time series file
+Each subcommand imports only the modules it needs, so that short batch invocations start quickly.
+"""
+
+import argparse
+import json
+import sys
+
+
+def read_pixel_list(args):
+    """Pixels from repeated --pixel LON LAT options and/or a --pixel_file with lon lat columns."""
+    pixel_list = [[float(lon), float(lat)] for lon, lat in (args.pixel or [])];
+    if args.pixel_file:
+        with open(args.pixel_file, 'r') as pixel_file:
+            for line in pixel_file:
+                fields = line.replace(',', ' ').split();
+                if len(fields) >= 2 and not line.startswith('#'):
+                    pixel_list.append([float(fields[0]), float(fields[1])]);
+    if not pixel_list:
+        raise SystemExit("Error: no pixels given. Use --pixel LON LAT or --pixel_file.");
+    return pixel_list;
+
+
+def run_package(args):
+    from . import cgm_packaging_functions
+    cgm_packaging_functions.drive_scec_hdf5_packaging(args.config);
+
+
+def run_empty_configs(args):
+    from . import io_cgm_configs
+    io_cgm_configs.write_empty_file_level_config(args.directory);
+    io_cgm_configs.write_empty_track_metadata_config(args.directory);
+
+
+def run_inspect(args):
+    from . import io_cgm_hdf5
+    for filename in args.files:
+        print(json.dumps(io_cgm_hdf5.summarize_cgm_product(filename), indent=2));
+
+
+def check_failures(failures):
+    """Exit with an error status if any file of a multi-file extraction failed (after its results are written)."""
+    if failures:
+        raise SystemExit("Error: extraction failed for %d file(s): %s" % (len(failures),
+                                                                         ", ".join([x[0] for x in failures])));
+    return;
+
+
+def run_extract_vels(args):
+    from . import hdf5_to_geocsv
+    velocity_list, failures = hdf5_to_geocsv.extract_vels_wrapper(args.files, read_pixel_list(args), args.snap_pixels,
+                                                                  args.method, args.footprint, args.n_workers,
+                                                                  return_failures=True);
+    if args.format == "json":
+        hdf5_to_geocsv.write_vels_to_json(velocity_list, args.output_dir);
+    else:
+        hdf5_to_geocsv.write_vels_to_csv(velocity_list, args.output_dir);
+    check_failures(failures);
+
+
+def run_extract_ts(args):
+    from . import hdf5_to_geocsv
+    _, failures = hdf5_to_geocsv.extract_csv_wrapper(args.files, read_pixel_list(args), args.output_dir,
+                                                     args.snap_pixels, args.method, args.footprint, args.n_workers,
+                                                     return_failures=True);
+    check_failures(failures);
+
+
+def run_export_csv(args):
+    from . import hdf5_to_geocsv
+    print(hdf5_to_geocsv.velocities_to_csv(args.file, args.bbox, args.output_dir));
+
+
+def run_export_json(args):
+    from . import hdf5_to_geocsv
+    print(hdf5_to_geocsv.velocities_to_json(args.file, args.bbox, args.output_dir));
+
+
+def run_export_gmt(args):
+    from . import cgm_to_gmt
+    date_range = [args.start_date, args.end_date] if args.time_series else None;
+    cgm_to_gmt.export_gmt_grids(args.file, args.output_dir, args.grids, date_range, args.bbox, args.n_workers);
+
+
+def run_export_zarr(args):
+    from . import cgm_zarr_store
+    cgm_zarr_store.write_cgm_zarr(args.file, args.store, (args.chunk_size, args.chunk_size), args.n_workers);
+
+
+def run_to_mintpy(args):
+    from . import cgm_to_mintpy
+    cgm_to_mintpy.convert_cgm_to_mintpy(args.file, args.output);
+
+
+def add_pixel_arguments(parser):
+    parser.add_argument('files', type=str, nargs='+', help='SCEC HDF5 files (or chunked stores). Required.')
+    parser.add_argument('--pixel', type=float, nargs=2, action='append', metavar=('LON', 'LAT'),
+                        help='pixel to extract (repeatable)')
+    parser.add_argument('--pixel_file', type=str, default=None, help='text file of pixels, columns lon lat')
+    parser.add_argument('--output_dir', type=str, default='.', help='output directory (default: .)')
+    parser.add_argument('--snap_pixels', type=int, default=0,
+                        help='snap pixels outside the data to the nearest valid pixel within this many pixels')
+    parser.add_argument('--method', type=str, default='nearest', choices=['nearest', 'bilinear', 'area'],
+                        help='sampling method (default: nearest)')
+    parser.add_argument('--footprint', type=float, nargs=2, default=None, metavar=('WIDTH', 'HEIGHT'),
+                        help='averaging box in degrees, for --method area')
+    parser.add_argument('--n_workers', type=int, default=1, help='number of files read in parallel (default: 1)')
+    return;
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cgm', description='Package, inspect, extract from, and convert SCEC '
+                                                             'CGM InSAR products. ',
+                                     epilog='\U0001f600 \U0001f600 \U0001f600 ');
+    subparsers = parser.add_subparsers(dest='command', metavar='command');
+    subparsers.required = True;
+
+    sub = subparsers.add_parser('package', help='write HDF5 files from local files');
+    sub.add_argument('config', type=str, help='name of file_level_config file. Required.')
+    sub.set_defaults(function=run_package);
+
+    sub = subparsers.add_parser('empty-configs', help='write empty config file templates');
+    sub.add_argument('directory', type=str, help='name of directory (can be . for current directory). Required.')
+    sub.set_defaults(function=run_empty_configs);
+
+    sub = subparsers.add_parser('inspect', help='print metadata and contents of products');
+    sub.add_argument('files', type=str, nargs='+', help='SCEC HDF5 files (or chunked stores). Required.')
+    sub.set_defaults(function=run_inspect);
+
+    sub = subparsers.add_parser('extract-vels', help='velocities at pixels');
+    add_pixel_arguments(sub);
+    sub.add_argument('--format', type=str, default='csv', choices=['csv', 'json'], help='output format')
+    sub.set_defaults(function=run_extract_vels);
+
+    sub = subparsers.add_parser('extract-ts', help='GeoCSV time series at pixels');
+    add_pixel_arguments(sub);
+    sub.set_defaults(function=run_extract_ts);
+
+    for name, function in [('export-csv', run_export_csv), ('export-json', run_export_json)]:
+        sub = subparsers.add_parser(name, help='velocities in a bounding box');
+        sub.add_argument('file', type=str, help='SCEC HDF5 file. Required.')
+        sub.add_argument('--bbox', type=float, nargs=4, required=True, metavar=('W', 'E', 'S', 'N'),
+                         help='bounding box in longitude and latitude. Required.')
+        sub.add_argument('--output_dir', type=str, default='.', help='output directory (default: .)')
+        sub.set_defaults(function=function);
+
+    sub = subparsers.add_parser('export-gmt', help='grids to GMT NetCDF files');
+    sub.add_argument('file', type=str, help='SCEC HDF5 file (or chunked store). Required.')
+    sub.add_argument('--output_dir', type=str, default='.', help='output directory (default: .)')
+    sub.add_argument('--grids', type=str, nargs='*', default=['velocities'],
+                     choices=['velocities', 'velo_unc', 'lkv_E', 'lkv_N', 'lkv_U', 'dem'],
+                     help='grids (default: velocities)')
+    sub.add_argument('--time_series', action='store_true', help='also export time series slices')
+    sub.add_argument('--start_date', type=str, default=None, help='first time series date, yyyymmdd')
+    sub.add_argument('--end_date', type=str, default=None, help='last time series date, yyyymmdd')
+    sub.add_argument('--bbox', type=float, nargs=4, default=None, metavar=('W', 'E', 'S', 'N'),
+                     help='clip grids to this bounding box')
+    sub.add_argument('--n_workers', type=int, default=1, help='number of grids written in parallel (default: 1)')
+    sub.set_defaults(function=run_export_gmt);
+
+    sub = subparsers.add_parser('export-zarr', help='product to a chunked directory store');
+    sub.add_argument('file', type=str, help='SCEC HDF5 file. Required.')
+    sub.add_argument('store', type=str, help='directory of the store. Required.')
+    sub.add_argument('--chunk_size', type=int, default=256, help='rows and columns per chunk (default: 256)')
+    sub.add_argument('--n_workers', type=int, default=4, help='number of chunk-writing processes (default: 4)')
+    sub.set_defaults(function=run_export_zarr);
+
+    sub = subparsers.add_parser('to-mintpy', help='pseudo-MintPy time series file');
+    sub.add_argument('file', type=str, help='SCEC HDF5 file with time series, one track. Required.')
+    sub.add_argument('output', type=str, help='name of the MintPy file to write. Required.')
+    sub.set_defaults(function=run_to_mintpy);
+    return parser;
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv);
+    args.function(args);
+    return 0;
+
+
+if __name__ == "__main__":
+    sys.exit(main());
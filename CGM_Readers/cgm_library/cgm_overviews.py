@@ -0,0 +1,221 @@
+"""
+Multi-resolution overviews (NaN-aware block averages) of CGM InSAR products, for map rendering and coarse queries.
+Overviews are stored inside each track group of the HDF5 file:
+Track_D071
+    └── Overviews
+        └── Level_2, Level_4, Level_8, ... (attributes: factor, xinc, yinc)
+            ├── lon, lat
+            ├── lkv_E, lkv_N, lkv_U
+            ├── velocities
+            └── Time_Series (optional)
+                └── yyyymmddThhmmss ...
+Like the full-resolution grids, overview grids are stored flipped (north row first) on disk.
+"""
+
+import h5py, re
+import numpy as np
+from . import cgm_quantization
+from . import io_cgm_hdf5
+
+OVERVIEW_GRIDS = {"lkv_E": "Grid_Info", "lkv_N": "Grid_Info", "lkv_U": "Grid_Info", "velocities": "Velocities"};
+
+
+def get_grid_spacing(lon_array, lat_array):
+    """
+    :param lon_array: 1D array of geocoded longitudes
+    :param lat_array: 1D array of geocoded latitudes
+    :return: xinc, yinc in degrees, derived from the grid itself
+    """
+    xinc = float(np.median(np.diff(lon_array))) if len(lon_array) > 1 else np.nan;
+    yinc = float(np.median(np.diff(lat_array))) if len(lat_array) > 1 else np.nan;
+    return xinc, yinc;
+
+
+def block_average(grid, factor):
+    """
+    NaN-aware block average of a 2D grid. The grid is padded with NaNs up to a multiple of factor.
+    Blocks with no valid pixels come out as NaN.
+
+    :param grid: 2D array
+    :param factor: int, number of pixels on each side of the averaging block
+    :return: 2D float32 array of shape ceil(ny/factor), ceil(nx/factor)
+    """
+    ny, nx = np.shape(grid);
+    out_ny, out_nx = -(-ny // factor), -(-nx // factor);
+    padded = np.full((out_ny*factor, out_nx*factor), np.nan, dtype=np.float64);
+    padded[0:ny, 0:nx] = grid;
+    blocks = padded.reshape(out_ny, factor, out_nx, factor);
+    valid = ~np.isnan(blocks);
+    counts = np.sum(valid, axis=(1, 3));
+    sums = np.sum(np.where(valid, blocks, 0), axis=(1, 3));
+    averaged = np.full((out_ny, out_nx), np.nan, dtype=np.float32);
+    averaged[counts > 0] = sums[counts > 0] / counts[counts > 0];
+    return averaged;
+
+
+def block_coordinates(coord_array, factor):
+    """Centers of the overview pixels along one axis, for pixel-node-registered ascending coordinates."""
+    inc = float(np.median(np.diff(coord_array))) if len(coord_array) > 1 else 0;
+    n_out = -(-len(coord_array) // factor);
+    first_edge = coord_array[0] - inc/2;
+    return first_edge + inc*factor*(np.arange(n_out) + 0.5);
+
+
+def write_overviews(hdf_file, factors=(2, 4, 8), include_time_series=False):
+    """
+    Add overview levels to every track of an existing CGM HDF5 file. Existing overviews are replaced.
+    Each grid is read once from disk and averaged to every level.
+
+    :param hdf_file: name of SCEC HDF5 File
+    :param factors: list of ints, block sizes of the overview levels (2, 4, 8, ...)
+    :param include_time_series: bool, whether to also build overviews of each time series slice
+    """
+    print("Writing overviews %s into file %s " % (list(factors), hdf_file));
+    hf = h5py.File(hdf_file, 'a');
+    all_keys = [x for x in hf.keys()];
+    all_keys.remove('Product_Metadata');
+    for track in all_keys:
+        track_data = hf.get(track);
+        print("Building overviews for track %s " % track_data.attrs["track_name"]);
+
+        # Gather full-resolution grids (on-disk paths) that need overviews
+        sources = [(name, group + '/' + name, '') for name, group in OVERVIEW_GRIDS.items()
+                   if group in track_data.keys() and name in track_data[group].keys()];
+        if include_time_series and 'Time_Series' in track_data.keys():
+            for keyname in track_data['Time_Series'].keys():
+                if re.match(r"[0-9]{8}T[0-9]{6}", keyname):
+                    sources.append((keyname, 'Time_Series/' + keyname, 'Time_Series/'));
+        grids = ((name, subgroup, np.flipud(cgm_quantization.read_grid(track_data[path])))   # one at a time
+                 for name, path, subgroup in sources);
+        write_track_overviews(track_data, grids, factors);
+    hf.close();
+    return;
+
+
+def write_track_overviews(track_data, grids, factors, pending=None):
+    """
+    Build the Overviews group of one track (replacing existing overviews) from latitude-increasing grids.
+    Used on existing files by write_overviews, and by io_cgm_hdf5.write_cgm_hdf5 while packaging.
+
+    :param track_data: h5py group for one track, with Grid_Info/lon and Grid_Info/lat
+    :param grids: iterable of (name, subgroup, grid): dataset name, '' or 'Time_Series/', and the 2D grid
+    :param factors: list of ints, block sizes of the overview levels (2, 4, 8, ...)
+    :param pending: list, for swmr layout (see io_cgm_hdf5.create_grid_dataset)
+    """
+    if 'Overviews' in track_data.keys():
+        del track_data['Overviews'];
+    ov_group = track_data.create_group('Overviews');
+    lon_array = np.array(track_data['Grid_Info/lon']);
+    lat_array = np.array(track_data['Grid_Info/lat']);
+    xinc, yinc = get_grid_spacing(lon_array, lat_array);
+    for factor in factors:
+        level = ov_group.create_group('Level_'+str(factor));
+        level.attrs["factor"] = factor;
+        level.attrs["xinc"] = xinc*factor;
+        level.attrs["yinc"] = yinc*factor;
+        level.create_dataset('lon', data=block_coordinates(lon_array, factor));
+        level.create_dataset('lat', data=block_coordinates(lat_array, factor));
+
+    for name, subgroup, grid in grids:
+        for factor in factors:
+            averaged = block_average(grid, factor);
+            tmp = io_cgm_hdf5.create_grid_dataset(ov_group['Level_'+str(factor)], subgroup + name, averaged,
+                                                  None, pending);   # stored flipped, like the full grids
+            tmp.attrs["node_offset"] = 1;
+    return;
+
+
+def choose_overview_level(track_data, resolution):
+    """
+    Pick the coarsest overview level whose spacing is no coarser than the requested resolution.
+
+    :param track_data: h5py group for one track
+    :param resolution: float, requested output resolution in degrees
+    :return: name of the overview group (e.g. 'Level_4'), or None for the full-resolution grids
+    """
+    if resolution is None or 'Overviews' not in track_data.keys():
+        return None;
+    best_level, best_inc = None, 0;
+    for level_name in track_data['Overviews'].keys():
+        level = track_data['Overviews'][level_name];
+        coarsest_inc = max(abs(level.attrs["xinc"]), abs(level.attrs["yinc"]));
+        if best_inc < coarsest_inc <= resolution * (1 + 1e-6):   # tolerance for floating-point spacing
+            best_level, best_inc = level_name, coarsest_inc;
+    return best_level;
+
+
+def get_bounding_box_slices(lon_array, lat_array, bounding_box):
+    """
+    :param lon_array: 1D array of ascending longitudes
+    :param lat_array: 1D array of ascending latitudes
+    :param bounding_box: [W, E, S, N] or None for the whole grid
+    :return: column slice and latitude-index slice covering the bounding box (possibly empty)
+    """
+    if bounding_box is None:
+        return slice(0, len(lon_array)), slice(0, len(lat_array));
+    [w, e, s, n] = bounding_box;
+    col_slice = slice(int(np.searchsorted(lon_array, w, side='left')),
+                      int(np.searchsorted(lon_array, e, side='right')));
+    lat_slice = slice(int(np.searchsorted(lat_array, s, side='left')),
+                      int(np.searchsorted(lat_array, n, side='right')));
+    return col_slice, lat_slice;
+
+
+def read_overview(hdf_file, resolution, bounding_box=None, grids=("velocities",)):
+    """
+    Read the coarsest available level that satisfies a requested resolution, only within a bounding box.
+    Falls back to the full-resolution grids when no overview is fine enough.
+
+    :param hdf_file: name of SCEC HDF5 File
+    :param resolution: float, requested output resolution in degrees (None for full resolution)
+    :param bounding_box: [W, E, S, N] in longitude and latitude, or None for the whole track
+    :param grids: names of grids to read: velocities, lkv_E, lkv_N, lkv_U, or time series keys like yyyymmddThhmmss
+    :return: a list of dictionaries (one per track) like read_cgm_hdf5_full_data, with only the requested grids,
+        and an additional "overview_factor" (1 for full resolution). Grids are latitude-increasing like the full reader.
+    """
+    print("Reading overviews from file %s " % hdf_file);
+    cgm_data_structure = [];
+    hf = io_cgm_hdf5.open_cgm_product(hdf_file);
+    product_metadata = hf.get("Product_Metadata");
+    all_keys = [x for x in hf.keys()];
+    all_keys.remove('Product_Metadata');
+    for track in all_keys:
+        track_data = hf.get(track);
+        publish_state = io_cgm_hdf5.get_publish_state(track_data);
+        if publish_state is not None and not publish_state[1]:
+            continue;   # track still being written by an SWMR writer
+        track_dict = {};
+        for item in track_data.attrs.keys():
+            track_dict[item] = track_data.attrs[item];
+        for item in product_metadata.attrs.keys():
+            track_dict[item] = product_metadata.attrs[item];
+
+        level_name = choose_overview_level(track_data, resolution);
+        if level_name is None:
+            level = track_data;
+            grid_paths = {**{name: group + '/' + name for name, group in OVERVIEW_GRIDS.items()},
+                          "lon": "Grid_Info/lon", "lat": "Grid_Info/lat"};
+            track_dict["overview_factor"] = 1;
+        else:
+            level = track_data['Overviews'][level_name];
+            grid_paths = {**{name: name for name in OVERVIEW_GRIDS.keys()}, "lon": "lon", "lat": "lat"};
+            track_dict["overview_factor"] = int(level.attrs["factor"]);
+
+        lon_array = np.array(level[grid_paths["lon"]]);
+        lat_array = np.array(level[grid_paths["lat"]]);
+        col_slice, lat_slice = get_bounding_box_slices(lon_array, lat_array, bounding_box);
+        ny = len(lat_array);
+        row_slice = slice(ny - lat_slice.stop, ny - lat_slice.start);   # grids are stored north row first
+        track_dict["lon"] = lon_array[col_slice];
+        track_dict["lat"] = lat_array[lat_slice];
+        for name in grids:
+            path = grid_paths.get(name, 'Time_Series/' + name);
+            if path not in level:
+                continue;
+            if lat_slice.start >= lat_slice.stop or col_slice.start >= col_slice.stop:
+                track_dict[name] = np.zeros((0, 0), dtype=np.float32);
+                continue;
+            track_dict[name] = np.flipud(cgm_quantization.read_grid(level[path], (row_slice, col_slice)));
+        cgm_data_structure.append(track_dict);
+    hf.close();
+    return cgm_data_structure;
@@ -4,16 +4,34 @@ Coordinating the packaging of HDF5 files for SCEC CGM InSAR
 
 from . import io_cgm_hdf5
 from . import io_cgm_configs
+from . import cgm_timeseries
 from netCDF4 import Dataset
+from concurrent.futures import ProcessPoolExecutor
+import datetime as dt
 import numpy as np
 import glob
+import os
 import re
 
+GRID_CONFIG_KEYS = ["unit_east_ll_grd", "unit_north_ll_grd", "unit_up_ll_grd", "dem_ll_grd", "velocity_ll_grd"];
+TRACK_CONFIG_KEYS = GRID_CONFIG_KEYS + ["safes_list", "ts_directory", "metadata_file"];
+UNCERTAINTY_CONFIG_KEYS = ["velocity_unc_ll_grd", "ts_unc_directory"];   # optional, empty or missing means none
+TRACK_METADATA_KEYS = ["track_name", "platform", "orbit_direction", "polygon_boundaries", "geocoded_increment",
+                       "geocoded_range", "approx_posting", "grdsample_flags", "los_sign_convention",
+                       "lkv_sign_convention", "coordinate_reference_system", "time_series_units", "velocity_units",
+                       "dem_source", "dem_heights", "start_time", "end_time", "n_times", "reference_image",
+                       "reference_frame"];
+
 
 def drive_scec_hdf5_packaging(fileio_config_file):
     """A coordinator function to package up an HDF5 file with SCEC InSAR CGM results from local files."""
     toplevel_config = io_cgm_configs.read_file_level_config(fileio_config_file);
     all_tracks = toplevel_config.sections()[1:];  # get 1 or more tracks in the top-level config
+    problems = preflight_packaging_inputs(toplevel_config);  # headers only, before any data is read
+    if problems:
+        raise ValueError("Packaging inputs failed validation with %d problem(s):\n  " % len(problems) +
+                         "\n  ".join(problems));
+    max_abs_error = io_cgm_configs.parse_max_abs_error(toplevel_config["general-config"]);
     tracks_datastructure = [];   # a list of dictionaries
     for one_track in all_tracks:  # loop through tracks in the fileio_config_file, reading metadata and data
         print("Reading data from track %s..." % one_track);
@@ -21,12 +39,17 @@ def drive_scec_hdf5_packaging(fileio_config_file):
         onetrack_data = read_one_track_data(toplevel_config[one_track]);
         onetrack_dict = {**onetrack_config._sections["track-config"], **onetrack_data};  # merging two dictionaries
         tracks_datastructure.append(onetrack_dict);
+    swmr = toplevel_config["general-config"].getboolean("swmr_writes", fallback=False);
+    overview_levels = io_cgm_configs.parse_overview_levels(toplevel_config["general-config"]);
+    overview_time_series = toplevel_config["general-config"].getboolean("overview_time_series", fallback=False);
     io_cgm_hdf5.write_cgm_hdf5(tracks_datastructure, toplevel_config,
                                output_filename=toplevel_config["general-config"]["hdf5_file"],
-                               write_velocities=True, write_time_series=True);
+                               write_velocities=True, write_time_series=True, max_abs_error=max_abs_error, swmr=swmr,
+                               overview_levels=overview_levels, overview_time_series=overview_time_series);
     io_cgm_hdf5.write_cgm_hdf5(tracks_datastructure, toplevel_config,
                                output_filename=toplevel_config["general-config"]["hdf5_vel_file"],
-                               write_velocities=True, write_time_series=False);
+                               write_velocities=True, write_time_series=False, max_abs_error=max_abs_error, swmr=swmr,
+                               overview_levels=overview_levels);
     return;
 
 
@@ -49,17 +72,42 @@ def read_one_track_data(fileio_config_dict):
     [_, _, velocity_grid] = read_netcdf4(fileio_config_dict["velocity_ll_grd"]);
     track_dict["velocities"] = velocity_grid;
 
-    # Getting time series. Glob pattern should match only the time series grids, not others.
-    ts_grd_files = glob.glob(fileio_config_dict["ts_directory"] + '/*[0-9]_ll.grd');
+    # Getting time series
+    for onefile, datestr_saving in get_ts_files_and_datestrs(fileio_config_dict):
+        track_dict[datestr_saving] = read_netcdf4(onefile)[2];  # saving the ts array
+
+    # Getting uncertainties, if provided
+    if fileio_config_dict.get("velocity_unc_ll_grd", ""):
+        track_dict["velo_unc"] = read_netcdf4(fileio_config_dict["velocity_unc_ll_grd"])[2];
+    if fileio_config_dict.get("ts_unc_directory", ""):
+        for onefile, datestr_saving in get_ts_files_and_datestrs(fileio_config_dict, "ts_unc_directory"):
+            track_dict[cgm_timeseries.UNCERTAINTY_PREFIX + datestr_saving] = read_netcdf4(onefile)[2];
+
+    # PACKAGING DATA STRUCTURE
+    verify_same_shapes(track_dict);  # defensive programming
+    return track_dict;
+
+
+def get_ts_files_and_datestrs(fileio_config_dict, directory_key="ts_directory"):
+    """
+    Find the time series grids of one track and the date string each one will be saved under.
+    Glob pattern should match only the time series grids, not others.
+
+    :param fileio_config_dict: the section of the file_level_config for one track
+    :param directory_key: config key of the directory ("ts_directory", or "ts_unc_directory" for uncertainties)
+    :returns: sorted list of [filename, datestr], where datestr is yyyymmddThhmmss from the safes_list,
+        or just yyyymmdd if the safe isn't listed
+    """
+    ts_grd_files = glob.glob(fileio_config_dict[directory_key] + '/*[0-9]_ll.grd');
     if fileio_config_dict["safes_list"]:
-        full_safe_list = np.loadtxt(fileio_config_dict["safes_list"], unpack=True,
-                                    dtype={'names': ('u10',), 'formats': ('U50',)});
-        safe_times = [x[0][17:32] for x in full_safe_list];
+        full_safe_list = np.loadtxt(fileio_config_dict["safes_list"], dtype=str, usecols=0, ndmin=1);
+        safe_times = [x[17:32] for x in full_safe_list];
     else:
         safe_times = [];
         # providing the full list of safes is strongly encouraged
     print("Found %s time series files" % len(ts_grd_files));
     ts_grd_files = sorted(ts_grd_files);
+    files_and_datestrs = [];
     for onefile in ts_grd_files:
         datestr_fine = [];
         datestr_coarse = re.findall(r"\d\d\d\d\d\d\d\d", onefile)[0];
@@ -67,11 +115,8 @@ def read_one_track_data(fileio_config_dict):
             if datestr_coarse in safe_time:
                 datestr_fine = safe_time
         datestr_saving = datestr_fine if datestr_fine else datestr_coarse;
-        track_dict[datestr_saving] = read_netcdf4(onefile)[2];  # saving the ts array
-
-    # PACKAGING DATA STRUCTURE
-    verify_same_shapes(track_dict);  # defensive programming
-    return track_dict;
+        files_and_datestrs.append([onefile, datestr_saving]);
+    return files_and_datestrs;
 
 
 def read_netcdf4(filename):
@@ -87,14 +132,7 @@ def read_netcdf4(filename):
     rootgrp = Dataset(filename, "r");
     if len(rootgrp.variables.keys()) == 6:
         # Use a gdal parsing: ['x_range', 'y_range', 'z_range', 'spacing', 'dimension', 'z']
-        xinc = float(rootgrp.variables['spacing'][0])
-        yinc = float(rootgrp.variables['spacing'][1])
-        xstart = float(rootgrp.variables['x_range'][0]) + xinc/2  # pixel-node-registered
-        xfinish = float(rootgrp.variables['x_range'][1])
-        xvar = np.arange(xstart, xfinish, xinc);
-        ystart = float(rootgrp.variables['y_range'][0]) + xinc/2  # pixel-node-registered
-        yfinish = float(rootgrp.variables['y_range'][1])
-        yvar = np.arange(ystart, yfinish, yinc);
+        xvar, yvar = get_gdal_axes(rootgrp);
         zvar = rootgrp.variables['z'][:].copy();
         zvar = np.flipud(np.reshape(zvar, (len(yvar), len(xvar))));  # frustrating.
     else:
@@ -105,6 +143,205 @@ def read_netcdf4(filename):
     return [xvar, yvar, zvar];
 
 
+def get_gdal_axes(rootgrp):
+    """Pixel-node-registered x and y axes of a gdal-style netcdf file, from its small header variables only."""
+    xinc = float(rootgrp.variables['spacing'][0])
+    yinc = float(rootgrp.variables['spacing'][1])
+    xstart = float(rootgrp.variables['x_range'][0]) + xinc/2  # pixel-node-registered
+    xfinish = float(rootgrp.variables['x_range'][1])
+    xvar = np.arange(xstart, xfinish, xinc);
+    ystart = float(rootgrp.variables['y_range'][0]) + xinc/2  # pixel-node-registered
+    yfinish = float(rootgrp.variables['y_range'][1])
+    yvar = np.arange(ystart, yfinish, yinc);
+    return xvar, yvar;
+
+
+def read_netcdf4_header(filename):
+    """
+    Read the grid geometry of a netcdf4 file without reading its data.
+
+    :param filename: name of netcdf4 file
+    :returns: dictionary with shape (ny, nx), xinc, yinc, x_range, y_range, and registration
+        ('pixel', 'gridline', or 'unknown')
+    """
+    rootgrp = Dataset(filename, "r");
+    if len(rootgrp.variables.keys()) == 6:
+        xvar, yvar = get_gdal_axes(rootgrp);
+        xinc = float(rootgrp.variables['spacing'][0]);
+        yinc = float(rootgrp.variables['spacing'][1]);
+        x_range = [float(x) for x in rootgrp.variables['x_range'][:]];
+        y_range = [float(x) for x in rootgrp.variables['y_range'][:]];
+        nx_header = int(rootgrp.variables['dimension'][0]);
+        ny_header = int(rootgrp.variables['dimension'][1]);
+        # pixel registration: the range covers exactly (dimension) cells; gridline: one more node than cells
+        if nx_header == int(round((x_range[1] - x_range[0]) / xinc)):
+            registration = 'pixel';
+        elif nx_header == int(round((x_range[1] - x_range[0]) / xinc)) + 1:
+            registration = 'gridline';
+        else:
+            registration = 'unknown';
+        shape = (len(yvar), len(xvar));
+        header_shape = (ny_header, nx_header);
+        z_size = int(rootgrp.variables['z'].size);
+    else:
+        [xkey, ykey, zkey] = rootgrp.variables.keys();  # assuming they come in a logical order like (lon, lat, z)
+        xvar = rootgrp.variables[xkey][:];  # 1D coordinate arrays are small
+        yvar = rootgrp.variables[ykey][:];
+        xinc = float(np.median(np.diff(xvar))) if len(xvar) > 1 else np.nan;
+        yinc = float(np.median(np.diff(yvar))) if len(yvar) > 1 else np.nan;
+        x_range = [float(np.min(xvar)), float(np.max(xvar))];
+        y_range = [float(np.min(yvar)), float(np.max(yvar))];
+        node_offset = rootgrp.getncattr('node_offset') if 'node_offset' in rootgrp.ncattrs() else None;
+        registration = {1: 'pixel', 0: 'gridline'}.get(node_offset, 'unknown');
+        shape = tuple(rootgrp.variables[zkey].shape);
+        header_shape = (len(yvar), len(xvar));
+        z_size = int(rootgrp.variables[zkey].size);
+    rootgrp.close();
+    return {"shape": shape, "header_shape": header_shape, "z_size": z_size, "xinc": xinc, "yinc": yinc,
+            "x_range": x_range, "y_range": y_range, "registration": registration};
+
+
+def preflight_packaging_inputs(toplevel_config):
+    """
+    Fail-fast validation of everything named in the file-level config and the track metadata configs,
+    reading only netcdf headers. Tracks are checked in parallel, and every problem is reported at once.
+
+    :param toplevel_config: configobj read from file-level config file
+    :returns: list of strings describing each problem (empty if everything looks ready to package)
+    """
+    all_tracks = toplevel_config.sections()[1:];
+    print("Validating packaging inputs for %d track(s)..." % len(all_tracks));
+    track_configs = [dict(toplevel_config[one_track]) for one_track in all_tracks];
+    with ProcessPoolExecutor(max_workers=max(1, min(len(all_tracks), os.cpu_count() or 1))) as pool:
+        results = list(pool.map(preflight_one_track, all_tracks, track_configs));
+
+    problems, track_geometries = [], [];
+    for track_problems, geometry in results:
+        problems = problems + track_problems;
+        if geometry is not None:
+            track_geometries.append(geometry);
+    # Consistency across tracks: every track should share the same posting and registration
+    for name, geometry in track_geometries[1:]:
+        first_name, first_geometry = track_geometries[0];
+        if not np.allclose([geometry["xinc"], geometry["yinc"]], [first_geometry["xinc"], first_geometry["yinc"]]):
+            problems.append("%s: spacing %s/%s differs from %s spacing %s/%s" % (
+                name, geometry["xinc"], geometry["yinc"], first_name, first_geometry["xinc"], first_geometry["yinc"]));
+        if geometry["registration"] != first_geometry["registration"]:
+            problems.append("%s: %s registration differs from %s %s registration" % (
+                name, geometry["registration"], first_name, first_geometry["registration"]));
+    for problem in problems:
+        print("  Problem: %s" % problem);
+    return problems;
+
+
+def preflight_one_track(track_section, fileio_config_dict):
+    """
+    Header-only validation of one track's inputs.
+
+    :param track_section: name of the track section in the file-level config, for messages
+    :param fileio_config_dict: dictionary of that section
+    :returns: list of problem strings, and [track_section, geometry of the velocity grid] (or None if unreadable)
+    """
+    problems = [];
+    missing_keys = [x for x in TRACK_CONFIG_KEYS if x not in fileio_config_dict.keys()];
+    for key in missing_keys:
+        problems.append("%s: missing key %s in file-level config" % (track_section, key));
+
+    # Track metadata config
+    n_times = None;
+    if "metadata_file" in fileio_config_dict.keys():
+        metadata_file = fileio_config_dict["metadata_file"];
+        if not os.path.isfile(metadata_file):
+            problems.append("%s: metadata file %s not found" % (track_section, metadata_file));
+        else:
+            track_config = io_cgm_configs.read_track_metadata_config(metadata_file);
+            if not track_config.has_section("track-config"):
+                problems.append("%s: no [track-config] section in %s" % (track_section, metadata_file));
+            else:
+                for key in TRACK_METADATA_KEYS:
+                    if not track_config.has_option("track-config", key):
+                        problems.append("%s: missing key %s in %s" % (track_section, key, metadata_file));
+                n_times = track_config["track-config"].get("n_times", "");
+
+    # Grid headers: shape, spacing, registration
+    headers = {};
+    grid_files = [(key, fileio_config_dict[key]) for key in GRID_CONFIG_KEYS if key in fileio_config_dict.keys()];
+    ts_files_and_datestrs = [];
+    if "ts_directory" in fileio_config_dict.keys() and "safes_list" in fileio_config_dict.keys():
+        if fileio_config_dict["safes_list"] and not os.path.isfile(fileio_config_dict["safes_list"]):
+            problems.append("%s: safes_list %s not found" % (track_section, fileio_config_dict["safes_list"]));
+        else:
+            ts_files_and_datestrs = get_ts_files_and_datestrs(fileio_config_dict);
+            if len(ts_files_and_datestrs) == 0:
+                problems.append("%s: no time series grids found in %s" % (track_section,
+                                                                          fileio_config_dict["ts_directory"]));
+    grid_files = grid_files + [(datestr, onefile) for onefile, datestr in ts_files_and_datestrs];
+    if fileio_config_dict.get("velocity_unc_ll_grd", ""):
+        grid_files.append(("velocity_unc_ll_grd", fileio_config_dict["velocity_unc_ll_grd"]));
+    if fileio_config_dict.get("ts_unc_directory", "") and "safes_list" in fileio_config_dict.keys():
+        ts_datestrs = [datestr for _, datestr in ts_files_and_datestrs];
+        for onefile, datestr in get_ts_files_and_datestrs(fileio_config_dict, "ts_unc_directory"):
+            grid_files.append((cgm_timeseries.UNCERTAINTY_PREFIX + datestr, onefile));
+            if datestr not in ts_datestrs:
+                problems.append("%s: uncertainty grid %s has no time series grid of the same date" % (track_section,
+                                                                                                    onefile));
+    for label, filename in grid_files:
+        if not os.path.isfile(filename):
+            problems.append("%s: %s file %s not found" % (track_section, label, filename));
+            continue;
+        try:
+            headers[label] = read_netcdf4_header(filename);
+        except Exception as e:
+            problems.append("%s: could not read header of %s: %s" % (track_section, filename, e));
+            continue;
+        if headers[label]["shape"] != headers[label]["header_shape"]:
+            problems.append("%s: %s header dimensions %s don't match its range/spacing %s" % (
+                track_section, filename, headers[label]["header_shape"], headers[label]["shape"]));
+        if headers[label]["z_size"] != headers[label]["shape"][0] * headers[label]["shape"][1]:
+            problems.append("%s: %s has %d values, expected %s" % (track_section, filename, headers[label]["z_size"],
+                                                                   headers[label]["shape"]));
+        if headers[label]["registration"] == 'gridline':
+            problems.append("%s: %s is gridline-registered; pixel registration expected" % (track_section, filename));
+    reference_label = "velocity_ll_grd" if "velocity_ll_grd" in headers.keys() else next(iter(headers), None);
+    geometry = None;
+    if reference_label is not None:
+        reference = headers[reference_label];
+        geometry = [track_section, reference];
+        for label, header in headers.items():
+            if header["shape"] != reference["shape"]:
+                problems.append("%s: %s shape %s differs from %s shape %s" % (
+                    track_section, label, header["shape"], reference_label, reference["shape"]));
+            if not np.allclose([header["xinc"], header["yinc"]], [reference["xinc"], reference["yinc"]]):
+                problems.append("%s: %s spacing %s/%s differs from %s spacing %s/%s" % (
+                    track_section, label, header["xinc"], header["yinc"], reference_label, reference["xinc"],
+                    reference["yinc"]));
+            if not np.allclose(header["x_range"] + header["y_range"], reference["x_range"] + reference["y_range"]):
+                problems.append("%s: %s range %s differs from %s range %s" % (
+                    track_section, label, header["x_range"] + header["y_range"], reference_label,
+                    reference["x_range"] + reference["y_range"]));
+
+    # Dates: each time series grid must parse to a unique date
+    datestrs = [datestr for _, datestr in ts_files_and_datestrs];
+    for onefile, datestr in ts_files_and_datestrs:
+        try:
+            if len(datestr) == 15:
+                dt.datetime.strptime(datestr, "%Y%m%dT%H%M%S");
+            else:
+                dt.datetime.strptime(datestr, "%Y%m%d");
+                problems.append("%s: %s not in safes_list; it would be saved without a time (%s)" % (
+                    track_section, onefile, datestr));
+        except ValueError:
+            problems.append("%s: date %s of %s does not parse" % (track_section, datestr, onefile));
+    for datestr in sorted(set(datestrs)):
+        if datestrs.count(datestr) > 1:
+            problems.append("%s: %d time series grids share the date %s" % (track_section, datestrs.count(datestr),
+                                                                            datestr));
+    if n_times and ts_files_and_datestrs and n_times.strip().isdigit() and int(n_times) != len(datestrs):
+        problems.append("%s: n_times is %s in the metadata, but %d time series grids were found" % (
+            track_section, n_times, len(datestrs)));
+    return problems, geometry;
+
+
 def verify_same_shapes(track_dict):
     """Defensive programming for one track of CGM data before packaging"""
     lon = track_dict["lon"];
@@ -118,4 +355,6 @@ def verify_same_shapes(track_dict):
     for keyname in track_dict.keys():
         if re.match(r"[0-9]{8}T[0-9]{6}", keyname):  # if we have time series slice, such as '20150121T134347'
             assert (np.shape(track_dict[keyname]) == expected_shape), ValueError("ts grid wrong size");
+        if keyname == "velo_unc" or keyname.startswith(cgm_timeseries.UNCERTAINTY_PREFIX):
+            assert (np.shape(track_dict[keyname]) == expected_shape), ValueError("uncertainty grid wrong size");
     return;
@@ -0,0 +1,68 @@
+"""
+Optional quantized storage profile for CGM InSAR grids: scaled integers with a bounded absolute error.
+A quantized dataset holds integers q, with attributes (CF convention, also understood by GDAL and netCDF readers):
+    scale_factor, add_offset : value = q * scale_factor + add_offset
+    _FillValue : integer sentinel for NaN
+    max_abs_error : the error bound requested when writing
+scale_factor is twice the requested maximum error, so rounding never moves a value by more than that error
+(plus the float32 rounding of the decoded value, as for any float32 grid).
+Grids are stored as int16 when the data range allows it at that precision, and int32 otherwise. A data range too
+large for int32 at that precision is an error (store such grids as float32, or ask for a larger error).
+"""
+
+import numpy as np
+
+def quantize_grid(grid, max_abs_error):
+    """
+    :param grid: 2D array of floats, possibly with NaNs
+    :param max_abs_error: float, maximum absolute error allowed, in the units of the grid (greater than 0)
+    :return: integer array, scale_factor, add_offset, fill value
+    """
+    if not max_abs_error > 0:
+        raise ValueError("max_abs_error must be greater than 0, got %s" % max_abs_error);
+    grid = np.asarray(grid, dtype=np.float64);
+    valid = ~np.isnan(grid);
+    scale_factor = 2.0 * max_abs_error;
+    add_offset = (np.min(grid[valid]) + np.max(grid[valid])) / 2 if np.any(valid) else 0.0;
+    quantized = np.round((np.where(valid, grid, add_offset) - add_offset) / scale_factor);
+    largest = np.max(np.abs(quantized));
+    if largest <= np.iinfo(np.int16).max:
+        dtype = np.int16;
+    elif largest <= np.iinfo(np.int32).max:
+        dtype = np.int32;
+    else:
+        raise ValueError("Data range of %g is too large to quantize with max_abs_error %g"
+                         % (2 * largest * scale_factor, max_abs_error));
+    fill_value = np.iinfo(dtype).min;   # never produced by rounding, since the range is symmetric about the offset
+    quantized[~valid] = fill_value;
+    return quantized.astype(dtype), scale_factor, add_offset, dtype(fill_value);
+
+
+def dequantize_grid(quantized, scale_factor, add_offset, fill_value):
+    """
+    :param quantized: integer array (or a single integer, such as one pixel of a grid)
+    :return: float32 array with NaN where the fill value was stored (0-d for a single integer)
+    """
+    quantized = np.asarray(quantized);
+    grid = np.where(quantized == fill_value, np.nan, quantized.astype(np.float64) * scale_factor + add_offset);
+    return grid.astype(np.float32);
+
+
+def is_quantized(dataset):
+    """True if an h5py dataset was written with the quantized storage profile."""
+    return "scale_factor" in dataset.attrs.keys();
+
+
+def read_grid(dataset, selection=()):
+    """
+    Read all or part of an h5py grid dataset, decoding quantized storage transparently.
+
+    :param dataset: h5py dataset
+    :param selection: tuple of slices (default: the whole dataset)
+    :return: numpy array (float32 for quantized datasets)
+    """
+    data = dataset[selection];
+    if is_quantized(dataset):
+        return dequantize_grid(data, dataset.attrs["scale_factor"], dataset.attrs["add_offset"],
+                               dataset.attrs["_FillValue"]);
+    return np.array(data);
@@ -0,0 +1,132 @@
+"""
+Vectorized sampling of CGM InSAR grids at arbitrary [lon, lat] points.
+Grid spacing is derived from each track's lon/lat arrays, so products at any posting are sampled correctly.
+Methods:
+    nearest : value of the nearest pixel
+    bilinear : bilinear interpolation of the 4 surrounding pixels
+    area : average over a rectangular footprint, each pixel weighted by its overlap with the footprint
+All methods are NaN-aware: NaN pixels are dropped and the remaining weights renormalized.
+A sampler is built once per track and point batch, then applied to any number of grids (velocities, look vectors,
+each time series slice).
+"""
+
+import numpy as np
+from . import cgm_overviews
+from . import cgm_timeseries
+
+SAMPLING_METHODS = ("nearest", "bilinear", "area");
+
+
+def build_sampler(lon_array, lat_array, pixel_list, method="nearest", footprint=None):
+    """
+    Compute the pixel indices and weights needed to sample a track's grids at many points.
+
+    :param lon_array: 1D array of ascending longitudes (pixel centers)
+    :param lat_array: 1D array of ascending latitudes (pixel centers)
+    :param pixel_list: list of structures [lon, lat], or an (N x 2) array
+    :param method: 'nearest', 'bilinear', or 'area'
+    :param footprint: [width, height] of the averaging box in degrees, for 'area' (default: one pixel)
+    :return: dictionary with rows, cols, weights (N x K arrays) and inside (N booleans, within the track's grid)
+    """
+    if method not in SAMPLING_METHODS:
+        raise ValueError("Unknown sampling method %s. Options are %s" % (method, SAMPLING_METHODS));
+    points = np.reshape(np.asarray(pixel_list, dtype=np.float64), (-1, 2));
+    lons, lats = points[:, 0], points[:, 1];
+    ny, nx = len(lat_array), len(lon_array);
+    xinc, yinc = cgm_overviews.get_grid_spacing(lon_array, lat_array);
+    xinc = 1.0 if np.isnan(xinc) else xinc;   # single-column grids
+    yinc = 1.0 if np.isnan(yinc) else yinc;
+    inside = (lons >= lon_array[0]) & (lons <= lon_array[-1]) & (lats >= lat_array[0]) & (lats <= lat_array[-1]);
+    col_f = (lons - lon_array[0]) / xinc;   # fractional column index
+    row_f = (lats - lat_array[0]) / yinc;   # fractional row index
+
+    if method == "nearest":
+        rows = np.clip(np.rint(row_f), 0, ny-1).astype(int)[:, None];
+        cols = np.clip(np.rint(col_f), 0, nx-1).astype(int)[:, None];
+        weights = np.ones(np.shape(rows));
+    elif method == "bilinear":
+        r0 = np.clip(np.floor(row_f), 0, max(ny-2, 0)).astype(int);
+        c0 = np.clip(np.floor(col_f), 0, max(nx-2, 0)).astype(int);
+        fr = np.clip(row_f - r0, 0, 1);
+        fc = np.clip(col_f - c0, 0, 1);
+        r1, c1 = np.minimum(r0 + 1, ny-1), np.minimum(c0 + 1, nx-1);
+        rows = np.stack([r0, r0, r1, r1], axis=1);
+        cols = np.stack([c0, c1, c0, c1], axis=1);
+        weights = np.stack([(1-fr)*(1-fc), (1-fr)*fc, fr*(1-fc), fr*fc], axis=1);
+    else:
+        if footprint is None:
+            footprint = [xinc, yinc];
+        half_x = footprint[0] / xinc / 2;   # half-widths in pixels
+        half_y = footprint[1] / yinc / 2;
+        row_offsets, row_weights = footprint_overlaps(row_f, half_y, ny);
+        col_offsets, col_weights = footprint_overlaps(col_f, half_x, nx);
+        n_points = len(lons);
+        rows = np.repeat(row_offsets, col_offsets.shape[1], axis=1).reshape(n_points, -1);
+        cols = np.tile(col_offsets, (1, row_offsets.shape[1]));
+        weights = (row_weights[:, :, None] * col_weights[:, None, :]).reshape(n_points, -1);
+    return {"rows": rows, "cols": cols, "weights": weights, "inside": inside};
+
+
+def footprint_overlaps(center, half_width, n):
+    """Along one axis: indices of pixels touched by [center-half_width, center+half_width] and their overlaps."""
+    first = np.floor(center - half_width + 0.5).astype(int);
+    k = int(np.ceil(2*half_width)) + 1;
+    indices = first[:, None] + np.arange(k)[None, :];
+    overlap = np.minimum(indices + 0.5, center[:, None] + half_width) - \
+        np.maximum(indices - 0.5, center[:, None] - half_width);
+    overlap = np.where((indices >= 0) & (indices < n), np.maximum(overlap, 0), 0);
+    return np.clip(indices, 0, n-1), overlap;
+
+
+def apply_sampler(grid, sampler):
+    """
+    :param grid: 2D array (latitude-increasing rows, like the track dictionary)
+    :param sampler: dictionary from build_sampler
+    :return: 1D float array of sampled values, NaN outside the grid or where all contributing pixels are NaN
+    """
+    values = np.asarray(grid)[sampler["rows"], sampler["cols"]].astype(np.float64);
+    valid = ~np.isnan(values) & (sampler["weights"] > 0);
+    weights = np.where(valid, sampler["weights"], 0);
+    total_weight = np.sum(weights, axis=1);
+    weighted_sum = np.sum(np.where(valid, values, 0) * weights, axis=1);
+    result = np.full(len(total_weight), np.nan);
+    good = (total_weight > 0) & sampler["inside"];
+    result[good] = weighted_sum[good] / total_weight[good];
+    return result;
+
+
+def sample_track(track_dict, sampler, grids=("velocities", "lkv_E", "lkv_N", "lkv_U", "dem")):
+    """
+    Sample several grids of one track at the sampler's points.
+
+    :param track_dict: dictionary for one track
+    :param sampler: dictionary from build_sampler, built on this track's lon/lat
+    :param grids: names of 2D grids in track_dict
+    :return: dictionary of 1D arrays for each grid that exists in track_dict
+    """
+    samples = {};
+    for name in grids:
+        if name in track_dict.keys():
+            samples[name] = apply_sampler(track_dict[name], sampler);
+    return samples;
+
+
+def sample_time_series(track_dict, sampler):
+    """
+    Sample every time series slice of one track at the sampler's points.
+
+    :param track_dict: dictionary for one track
+    :param sampler: dictionary from build_sampler, built on this track's lon/lat
+    :return: sorted list of date keys (yyyymmddThhmmss), an (N x T) array of displacements, and an (N x T) array of
+        uncertainties (weighted like the displacements) or None if the track has no uncertainty slices
+    """
+    date_keys, _ = cgm_timeseries.get_ts_dates(track_dict);
+    ts_matrix = np.full((len(sampler["inside"]), len(date_keys)), np.nan);
+    unc_matrix = None;
+    for i, keyname in enumerate(date_keys):
+        ts_matrix[:, i] = apply_sampler(track_dict[keyname], sampler);
+        if cgm_timeseries.UNCERTAINTY_PREFIX + keyname in track_dict:
+            if unc_matrix is None:
+                unc_matrix = np.full((len(sampler["inside"]), len(date_keys)), np.nan);
+            unc_matrix[:, i] = apply_sampler(track_dict[cgm_timeseries.UNCERTAINTY_PREFIX + keyname], sampler);
+    return date_keys, ts_matrix, unc_matrix;
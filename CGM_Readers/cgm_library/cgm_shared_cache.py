@@ -0,0 +1,195 @@
+"""
+Shared-memory cache of CGM InSAR tracks, for pre-forked serving processes.
+A loader process reads an HDF5 file once and places each track's arrays in a named shared-memory block.
+Worker processes attach read-only NumPy views of those arrays with no copies, so resident memory doesn't grow with
+the number of workers. The attached cgm_data_structure has the same keys as read_cgm_hdf5_full_data, so the
+in-memory consumers in hdf5_to_geocsv work on it unchanged.
+
+Shared-memory blocks for a cache named by prefix:
+    {prefix}_manifest : JSON describing tracks, metadata, and where each array lives
+    {prefix}_refs : int64 count of attached workers
+    {prefix}_track{i} : all arrays of track i, back to back
+Blocks outlive the loader; remove them with cleanup_track_cache (or 'cgm_shared_cache.py cleanup').
+"""
+
+import fcntl
+import json
+import os
+import re
+import tempfile
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from . import io_cgm_hdf5
+from . import cgm_timeseries
+
+ALIGNMENT = 64;  # bytes, start of each array in a block
+
+
+def create_block(name, size):
+    """Create a shared-memory block that isn't removed when this process exits."""
+    block = shared_memory.SharedMemory(name=name, create=True, size=max(size, 1));
+    resource_tracker.unregister(block._name, "shared_memory");
+    return block;
+
+
+def open_block(name):
+    """Attach an existing shared-memory block, without letting this process's exit remove it."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False);  # python >= 3.13
+    except TypeError:
+        block = shared_memory.SharedMemory(name=name);
+        resource_tracker.unregister(block._name, "shared_memory");
+        return block;
+
+
+def refcount_lock(prefix):
+    """Open (and create if needed) the lock file that serializes reference count updates for a cache."""
+    return open(os.path.join(tempfile.gettempdir(), prefix + ".lock"), 'a');
+
+
+def update_refcount(prefix, change):
+    """Add change to the reference count of a cache, under a file lock. Returns the new count."""
+    with refcount_lock(prefix) as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX);
+        block = open_block(prefix + "_refs");
+        counter = np.ndarray((1,), dtype=np.int64, buffer=block.buf);
+        counter[0] += change;
+        new_count = int(counter[0]);
+        del counter;
+        block.close();
+        fcntl.flock(lockfile, fcntl.LOCK_UN);
+    return new_count;
+
+
+def load_track_cache(hdf_file, prefix, include_time_series=False):
+    """
+    Loader side: read a CGM HDF5 file and publish its tracks into shared memory.
+
+    :param hdf_file: name of SCEC HDF5 File
+    :param prefix: string naming the cache (workers attach with the same prefix)
+    :param include_time_series: bool, whether to also share the time series slices (velocities, look vectors,
+        DEM, and masks are always shared)
+    :return: the manifest dictionary
+    """
+    cgm_data_structure = io_cgm_hdf5.read_cgm_hdf5_full_data(hdf_file, include_uncertainties=include_time_series);
+    print("Loading %d track(s) into shared memory cache %s " % (len(cgm_data_structure), prefix));
+    manifest = {"source_file": hdf_file, "tracks": []};
+    for i, track_dict in enumerate(cgm_data_structure):
+        metadata, arrays, layout, size = {}, {}, {}, 0;
+        for key, value in track_dict.items():
+            if isinstance(value, np.ndarray):
+                is_slice = re.match(r"[0-9]{8}T[0-9]{6}", key) or key.startswith(cgm_timeseries.UNCERTAINTY_PREFIX);
+                if is_slice and not include_time_series:
+                    continue;   # time series slice or its uncertainty, such as '20150121T134347'
+                value = np.ascontiguousarray(value);
+                size = -(-size // ALIGNMENT) * ALIGNMENT;
+                layout[key] = [size, list(value.shape), value.dtype.str];
+                arrays[key] = value;
+                size = size + value.nbytes;
+            else:
+                metadata[key] = value.item() if isinstance(value, np.generic) else value;
+        block_name = prefix + "_track" + str(i);
+        block = create_block(block_name, size);
+        for key, value in arrays.items():
+            offset, shape, dtype = layout[key];
+            np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset)[...] = value;
+        block.close();
+        manifest["tracks"].append({"block": block_name, "metadata": metadata, "arrays": layout});
+
+    manifest_bytes = json.dumps(manifest).encode();
+    block = create_block(prefix + "_manifest", len(manifest_bytes));
+    block.buf[0:len(manifest_bytes)] = manifest_bytes;
+    block.close();
+    block = create_block(prefix + "_refs", 8);
+    block.buf[0:8] = np.zeros(1, dtype=np.int64).tobytes();
+    block.close();
+    return manifest;
+
+
+def read_manifest(prefix):
+    """:return: the manifest dictionary of an existing cache"""
+    block = open_block(prefix + "_manifest");
+    manifest = json.loads(bytes(block.buf).rstrip(b'\x00').decode());
+    block.close();
+    return manifest;
+
+
+def attach_track_cache(prefix):
+    """
+    Worker side: attach read-only, zero-copy views of a cache's arrays.
+
+    :param prefix: string naming the cache
+    :return: cgm_data_structure (list of track dictionaries, like read_cgm_hdf5_full_data), and a handle to pass to
+        detach_track_cache when the worker is done with the arrays
+    """
+    manifest = read_manifest(prefix);
+    cgm_data_structure, blocks = [], [];
+    for track in manifest["tracks"]:
+        block = open_block(track["block"]);
+        blocks.append(block);
+        track_dict = dict(track["metadata"]);
+        for key, (offset, shape, dtype) in track["arrays"].items():
+            view = np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset);
+            view.flags.writeable = False;
+            track_dict[key] = view;
+        cgm_data_structure.append(track_dict);
+    update_refcount(prefix, 1);
+    return cgm_data_structure, {"prefix": prefix, "blocks": blocks};
+
+
+def detach_track_cache(cgm_data_structure, handle):
+    """
+    Worker side: drop the views and release the shared-memory blocks of an attached cache.
+
+    :param cgm_data_structure: the structure returned by attach_track_cache (its arrays are removed)
+    :param handle: the handle returned by attach_track_cache
+    :return: number of workers still attached
+    """
+    for track_dict in cgm_data_structure:
+        track_dict.clear();   # views must be released before their blocks can be closed
+    for block in handle["blocks"]:
+        block.close();
+    return update_refcount(handle["prefix"], -1);
+
+
+def get_cache_status(prefix):
+    """:return: dictionary with the source file, track names, shared bytes, and number of attached workers"""
+    manifest = read_manifest(prefix);
+    total_bytes = 0;
+    for track in manifest["tracks"]:
+        for offset, shape, dtype in track["arrays"].values():
+            total_bytes = total_bytes + int(np.prod(shape)) * np.dtype(dtype).itemsize;
+    return {"source_file": manifest["source_file"],
+            "tracks": [track["metadata"].get("track_name") for track in manifest["tracks"]],
+            "shared_bytes": total_bytes, "attached_workers": update_refcount(prefix, 0)};
+
+
+def cleanup_track_cache(prefix, force=False):
+    """
+    Remove all shared-memory blocks of a cache. Refuses while workers are attached, unless force is True.
+
+    :param prefix: string naming the cache
+    :param force: bool, remove even if the reference count is not zero (e.g. after workers crashed)
+    :return: True if the cache was removed
+    """
+    try:
+        manifest = read_manifest(prefix);
+    except FileNotFoundError:
+        print("No shared memory cache named %s " % prefix);
+        return False;
+    attached = update_refcount(prefix, 0);
+    if attached > 0 and not force:
+        print("Not removing cache %s: %d worker(s) still attached " % (prefix, attached));
+        return False;
+    for block_name in [track["block"] for track in manifest["tracks"]] + [prefix + "_manifest", prefix + "_refs"]:
+        try:
+            block = shared_memory.SharedMemory(name=block_name);   # tracked here, so unlink() stays balanced
+            block.close();
+            block.unlink();
+        except FileNotFoundError:
+            pass;
+    lock_path = os.path.join(tempfile.gettempdir(), prefix + ".lock");
+    if os.path.isfile(lock_path):
+        os.remove(lock_path);
+    print("Removed shared memory cache %s " % prefix);
+    return True;
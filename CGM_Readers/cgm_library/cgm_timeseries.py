@@ -0,0 +1,63 @@
+"""
+Columnar time series access for many pixels at once: one sorted datetime64 array of dates per track, and an
+(N pixels x T dates) float32 matrix of displacements, plus a matching matrix of uncertainties when the track has
+uncertainty slices (track_dict["unc_" + yyyymmddThhmmss]).
+The dates of a track are parsed once and cached, instead of once per pixel.
+"""
+
+import functools
+import re
+import numpy as np
+
+UNCERTAINTY_PREFIX = "unc_";   # track_dict key of the uncertainty slice of a date, such as 'unc_20150121T134347'
+
+
+@functools.lru_cache(maxsize=256)
+def parse_ts_keys(keys):
+    """
+    :param keys: tuple of all keys of a track dictionary
+    :return: sorted tuple of time series keys (yyyymmddThhmmss), and their read-only datetime64[s] array
+    """
+    date_keys = tuple(sorted([x for x in keys if re.match(r"[0-9]{8}T[0-9]{6}", x)]));
+    dates = np.array([x[0:4] + '-' + x[4:6] + '-' + x[6:8] + 'T' + x[9:11] + ':' + x[11:13] + ':' + x[13:15]
+                      for x in date_keys], dtype='datetime64[s]');
+    dates.flags.writeable = False;
+    return date_keys, dates;
+
+
+def get_ts_dates(track_dict):
+    """
+    :param track_dict: dictionary for one track
+    :return: sorted tuple of time series keys, and their datetime64[s] array (cached for the same set of keys)
+    """
+    return parse_ts_keys(tuple(track_dict.keys()));
+
+
+def extract_ts_matrix(track_dict, rows, cols):
+    """
+    Time series of N pixels of one track, reading each slice once for all pixels.
+
+    :param track_dict: dictionary for one track
+    :param rows: N row indices (latitude-increasing, like the track dictionary)
+    :param cols: N column indices
+    :return: dates (T datetime64[s], sorted), displacements (N x T float32), and uncertainties (N x T float32,
+        NaN for dates without an uncertainty slice) or None if the track has no uncertainty slices
+    """
+    date_keys, dates = get_ts_dates(track_dict);
+    rows, cols = np.asarray(rows, dtype=int), np.asarray(cols, dtype=int);
+    ts_matrix = np.full((len(rows), len(date_keys)), np.nan, dtype=np.float32);
+    unc_matrix = None;
+    if len(rows) == 0:
+        return dates, ts_matrix, unc_matrix;
+    for i, keyname in enumerate(date_keys):
+        ts_matrix[:, i] = track_dict[keyname][rows, cols];
+        if UNCERTAINTY_PREFIX + keyname in track_dict:
+            if unc_matrix is None:
+                unc_matrix = np.full((len(rows), len(date_keys)), np.nan, dtype=np.float32);
+            unc_matrix[:, i] = track_dict[UNCERTAINTY_PREFIX + keyname][rows, cols];
+    return dates, ts_matrix, unc_matrix;
+
+
+def dates_to_strings(dates):
+    """:return: ISO 8601 UTC strings like '2015-01-21T13:43:47Z' for an array of datetime64"""
+    return [x + 'Z' for x in np.datetime_as_string(np.asarray(dates, dtype='datetime64[s]'), unit='s')];
@@ -0,0 +1,154 @@
+"""
+Export grids of a CGM product back to pixel-node-registered GMT NetCDF grids, the reverse of the packaging step.
+Each grid is read (only its clipped region) and written on its own, in parallel across grids, so the whole product
+never has to be in memory. Output layout, one directory per track:
+
+output_dir/D071/
+    ├── velocities_ll.grd, lkv_E_ll.grd, lkv_N_ll.grd, lkv_U_ll.grd, dem_ll.grd
+    ├── 20150121T134347_ll.grd (one per time series slice)
+    └── uncertainties/20150121T134347_ll.grd (for products with time series uncertainties)
+
+The directory can be used directly as ts_directory of a file_level_config (and uncertainties/ as ts_unc_directory):
+reading these files with
+cgm_packaging_functions.read_netcdf4 returns the same lon, lat, and float32 values as the product.
+"""
+
+import os
+import re
+import numpy as np
+from netCDF4 import Dataset
+from concurrent.futures import ProcessPoolExecutor
+from . import io_cgm_hdf5
+
+GRID_PATHS = {"velocities": "Velocities/velocities", "velo_unc": "Velocities/velo_unc", "lkv_E": "Grid_Info/lkv_E",
+              "lkv_N": "Grid_Info/lkv_N", "lkv_U": "Grid_Info/lkv_U", "dem": "Grid_Info/dem"};
+
+
+def write_netcdf4(filename, lon, lat, grid, title="", units=""):
+    """
+    Write a pixel-node-registered GMT grid (COARDS/CF NetCDF with node_offset = 1).
+
+    :param filename: name of the output grid
+    :param lon: 1D array of pixel-center longitudes, increasing
+    :param lat: 1D array of pixel-center latitudes, increasing
+    :param grid: 2D array, latitude-increasing rows (like the track dictionary), NaN for no data
+    :param title: string
+    :param units: string, units of the grid values
+    """
+    grid = np.asarray(grid, dtype=np.float32);
+    rootgrp = Dataset(filename, "w", format="NETCDF4");
+    rootgrp.Conventions = "CF-1.7";
+    rootgrp.title = title;
+    rootgrp.node_offset = np.int32(1);    # pixel-node registration
+    rootgrp.createDimension('lon', len(lon));
+    rootgrp.createDimension('lat', len(lat));
+    xinc = lon[1] - lon[0] if len(lon) > 1 else 0;
+    yinc = lat[1] - lat[0] if len(lat) > 1 else 0;
+    lon_var = rootgrp.createVariable('lon', 'f8', ('lon',));
+    lon_var.long_name = "longitude";
+    lon_var.units = "degrees_east";
+    lon_var.actual_range = [lon[0] - xinc / 2, lon[-1] + xinc / 2];   # pixel edges
+    lon_var[:] = lon;
+    lat_var = rootgrp.createVariable('lat', 'f8', ('lat',));
+    lat_var.long_name = "latitude";
+    lat_var.units = "degrees_north";
+    lat_var.actual_range = [lat[0] - yinc / 2, lat[-1] + yinc / 2];
+    lat_var[:] = lat;
+    z_var = rootgrp.createVariable('z', 'f4', ('lat', 'lon'), zlib=True, fill_value=False);  # NaN means no data
+    z_var.long_name = "z";
+    z_var.units = units;
+    valid = grid[~np.isnan(grid)];
+    z_var.actual_range = [np.min(valid), np.max(valid)] if len(valid) > 0 else [np.nan, np.nan];
+    z_var[:, :] = grid;
+    rootgrp.close();
+    return;
+
+
+def get_clip_bounds(lon, lat, bounding_box=None):
+    """
+    :param bounding_box: [W, E, S, N] in longitude and latitude, or None for the whole grid
+    :return: [row_start, row_stop, col_start, col_stop] of the pixels whose centers are inside the box
+    """
+    if bounding_box is None:
+        return [0, len(lat), 0, len(lon)];
+    cols = np.where((lon >= bounding_box[0]) & (lon <= bounding_box[1]))[0];
+    rows = np.where((lat >= bounding_box[2]) & (lat <= bounding_box[3]))[0];
+    if len(cols) == 0 or len(rows) == 0:
+        return None;
+    return [int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1];
+
+
+def export_one_grid(input_filename, dataset_path, bounds, outfile, title, units):
+    """Read one clipped grid from the product and write it as a GMT grid. Runs in the export worker processes."""
+    hf = io_cgm_hdf5.open_cgm_product(input_filename);
+    grid_info = hf[dataset_path.split("/")[0] + "/Grid_Info"];
+    lon = np.array(grid_info["lon"])[bounds[2]:bounds[3]];
+    lat = np.array(grid_info["lat"])[bounds[0]:bounds[1]];
+    grid = io_cgm_hdf5.LazyGrid(hf[dataset_path])[bounds[0]:bounds[1], bounds[2]:bounds[3]];
+    write_netcdf4(outfile, lon, lat, grid, title=title, units=units);
+    hf.close();
+    return outfile;
+
+
+def export_one_grid_task(args):
+    """Single-argument wrapper of export_one_grid, for executor.map."""
+    return export_one_grid(*args);
+
+
+def export_gmt_grids(input_filename, output_dir, grids=("velocities",), date_range=None, bounding_box=None,
+                     n_workers=1):
+    """
+    Write selected grids of a CGM product as pixel-node-registered GMT NetCDF grids.
+
+    :param input_filename: name of SCEC HDF5 File (or chunked directory store)
+    :param output_dir: string, a subdirectory is made for each track
+    :param grids: names among "velocities", "velo_unc", "lkv_E", "lkv_N", "lkv_U", "dem"
+    :param date_range: None for no time series, or [start, end] as 'yyyymmdd' strings (inclusive; either can be
+        None for an open end) to export the time series slices in that range
+    :param bounding_box: [W, E, S, N] to clip each grid, or None for whole grids
+    :param n_workers: int, number of processes writing grids in parallel
+    :return: list of the grid files written
+    """
+    print("Exporting GMT grids from %s " % input_filename);
+    tasks = [];
+    hf = io_cgm_hdf5.open_cgm_product(input_filename);
+    all_keys = [x for x in hf.keys()];
+    all_keys.remove('Product_Metadata');
+    for track in all_keys:
+        track_data = hf.get(track);
+        track_name = str(track_data.attrs["track_name"]);
+        bounds = get_clip_bounds(np.array(track_data["Grid_Info/lon"]), np.array(track_data["Grid_Info/lat"]),
+                                 bounding_box);
+        if bounds is None:
+            print("Track %s doesn't overlap the bounding box " % track_name);
+            continue;
+        track_dir = os.path.join(output_dir, track_name);
+        os.makedirs(track_dir, exist_ok=True);
+        for name in grids:
+            if GRID_PATHS[name] in track_data:
+                units = str(track_data.attrs["velocity_units"]) if name in ["velocities", "velo_unc"] else "";
+                tasks.append((input_filename, track + "/" + GRID_PATHS[name], bounds,
+                              os.path.join(track_dir, name + "_ll.grd"), track_name + " " + name, units));
+        if date_range is not None and 'Time_Series' in track_data:
+            start = date_range[0] if date_range[0] is not None else "00000000";
+            end = date_range[1] if date_range[1] is not None else "99999999";
+            for keyname in track_data['Time_Series'].keys():
+                if re.match(r"[0-9]{8}T[0-9]{6}", keyname) and start <= keyname[0:8] <= end:
+                    tasks.append((input_filename, track + "/Time_Series/" + keyname, bounds,
+                                  os.path.join(track_dir, keyname + "_ll.grd"), track_name + " " + keyname,
+                                  str(track_data.attrs["time_series_units"])));
+                    if 'Time_Series/Uncertainties/' + keyname in track_data:
+                        os.makedirs(os.path.join(track_dir, "uncertainties"), exist_ok=True);
+                        tasks.append((input_filename, track + "/Time_Series/Uncertainties/" + keyname, bounds,
+                                      os.path.join(track_dir, "uncertainties", keyname + "_ll.grd"),
+                                      track_name + " uncertainty " + keyname,
+                                      str(track_data.attrs["time_series_units"])));
+    hf.close();
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            written = list(executor.map(export_one_grid_task, tasks));
+    else:
+        written = [export_one_grid(*task) for task in tasks];
+    print("Wrote %d grids to %s " % (len(written), output_dir));
+    return written;
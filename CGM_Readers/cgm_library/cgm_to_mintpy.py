@@ -2,6 +2,7 @@
 import h5py
 import numpy as np
 from . import io_cgm_hdf5
+from . import cgm_timeseries
 
 
 def convert_cgm_to_mintpy(cgm_filename, out_mintpy_filename):
@@ -34,17 +35,17 @@ def read_overview_mintpy_file(filename):
 def get_cgm_dates(track_dict):
     """
     Start with a Track_dict.
-    Return a list of acquisition dates in byte-string YYYYMMDD format, like b"20190622"
+    Return a list of acquisition dates in byte-string YYYYMMDD format, like b"20190622", in date order
     """
-    dates = [str(x[0:8]).encode() for x in track_dict.keys() if len(x) == 15 and x[0] in ['1', '2']];
-    return dates;
+    _, dates = cgm_timeseries.get_ts_dates(track_dict);
+    return [x.replace('-', '').encode() for x in np.datetime_as_string(dates, unit='D')];
 
 
 def get_cgm_data_cube(track_dict):
     """
-    Start with a Track_dict. Return a 3D data cube flipped in ascending order.
+    Start with a Track_dict. Return a 3D data cube flipped in ascending order, with slices in date order.
     """
-    dates = [x for x in track_dict.keys() if len(x) == 15 and x[0] in ['1', '2']];
+    dates, _ = cgm_timeseries.get_ts_dates(track_dict);
     slice_shape = np.shape(track_dict[dates[0]]);
     total_shape = (len(dates), slice_shape[0], slice_shape[1]);
     total_cube = np.zeros(total_shape);
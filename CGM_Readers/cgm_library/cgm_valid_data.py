@@ -0,0 +1,134 @@
+"""
+Valid-data domain of each CGM InSAR track: a per-pixel bitmask and tight row/column bounds, computed at packaging time.
+Extractors use them to reject pixels outside coverage, or snap them to the nearest valid pixel,
+without reading any time series data.
+Stored in the HDF5 file as:
+Track_D071
+    └── Grid_Info
+        ├── Attributes: valid_bounds [row_min, row_max, col_min, col_max] (latitude-increasing rows, -1 if empty)
+        └── valid_mask (uint8, 1 = valid data, stored flipped like the other grids)
+"""
+
+import h5py, re
+import numpy as np
+from . import cgm_quantization
+
+
+def compute_valid_mask(track_dict):
+    """
+    A pixel is valid if any time series slice has data there (or the velocity, if there are no time series slices).
+
+    :param track_dict: dictionary for one track, with latitude-increasing 2D grids
+    :return: 2D boolean array
+    """
+    mask = None;
+    for keyname in track_dict.keys():
+        if re.match(r"[0-9]{8}T[0-9]{6}", keyname):  # if we have time series slice, such as '20150121T134347'
+            slice_valid = ~np.isnan(track_dict[keyname]);
+            mask = slice_valid if mask is None else np.logical_or(mask, slice_valid);
+    if mask is None:
+        mask = ~np.isnan(track_dict["velocities"]);
+    return np.asarray(mask, dtype=bool);
+
+
+def compute_valid_bounds(mask):
+    """
+    :param mask: 2D boolean array
+    :return: [row_min, row_max, col_min, col_max], inclusive. All -1 if there is no valid data.
+    """
+    rows = np.where(np.any(mask, axis=1))[0];
+    cols = np.where(np.any(mask, axis=0))[0];
+    if len(rows) == 0:
+        return [-1, -1, -1, -1];
+    return [int(rows[0]), int(rows[-1]), int(cols[0]), int(cols[-1])];
+
+
+def write_valid_mask(grid_group, mask):
+    """Write the mask and its bounds into the Grid_Info group of one track (replacing an existing mask)."""
+    if 'valid_mask' in grid_group.keys():
+        del grid_group['valid_mask'];
+    tmp = grid_group.create_dataset('valid_mask', data=np.flipud(np.uint8(mask)));
+    tmp.attrs["node_offset"] = 1;
+    grid_group.attrs["valid_bounds"] = compute_valid_bounds(mask);
+    return;
+
+
+def read_valid_mask(grid_group):
+    """
+    :param grid_group: h5py Grid_Info group for one track
+    :return: latitude-increasing boolean mask and its bounds, or None, None for files written without a mask
+    """
+    if 'valid_mask' not in grid_group.keys():
+        return None, None;
+    mask = np.flipud(np.array(grid_group.get('valid_mask'))).astype(bool);
+    bounds = [int(x) for x in grid_group.attrs["valid_bounds"]];
+    return mask, bounds;
+
+
+def add_valid_mask_to_file(hdf_file):
+    """
+    Compute and store the valid-data mask for every track of an existing CGM HDF5 file (e.g. written before masks).
+    Time series slices are read one at a time.
+
+    :param hdf_file: name of SCEC HDF5 File
+    """
+    print("Adding valid-data masks to file %s " % hdf_file);
+    hf = h5py.File(hdf_file, 'a');
+    all_keys = [x for x in hf.keys()];
+    all_keys.remove('Product_Metadata');
+    for track in all_keys:
+        track_data = hf.get(track);
+        mask = None;
+        if 'Time_Series' in track_data.keys():
+            for keyname in track_data['Time_Series'].keys():
+                if re.match(r"[0-9]{8}T[0-9]{6}", keyname):
+                    slice_valid = ~np.isnan(np.flipud(cgm_quantization.read_grid(track_data['Time_Series'][keyname])));
+                    mask = slice_valid if mask is None else np.logical_or(mask, slice_valid);
+        if mask is None:
+            mask = ~np.isnan(np.flipud(cgm_quantization.read_grid(track_data['Velocities/velocities'])));
+        write_valid_mask(track_data['Grid_Info'], mask);
+    hf.close();
+    return;
+
+
+def is_valid_pixel(track_dict, rownum, colnum):
+    """
+    Fast check against the precomputed mask. Files without a mask are treated as valid everywhere.
+
+    :param track_dict: dictionary for one track
+    :param rownum: int
+    :param colnum: int
+    :return: bool
+    """
+    if track_dict.get("valid_mask") is None:
+        return True;
+    bounds = track_dict["valid_bounds"];
+    if not (bounds[0] <= rownum <= bounds[1] and bounds[2] <= colnum <= bounds[3]):
+        return False;
+    return bool(track_dict["valid_mask"][rownum][colnum]);
+
+
+def find_nearest_valid_pixel(track_dict, rownum, colnum, max_pixels):
+    """
+    Snap a pixel to the nearest valid pixel (Euclidean distance in pixels) within a tolerance, using only the mask.
+
+    :param track_dict: dictionary for one track, with "valid_mask" and "valid_bounds"
+    :param rownum: int
+    :param colnum: int
+    :param max_pixels: int, search tolerance in pixels
+    :return: rownum, colnum of the nearest valid pixel, or np.nan, np.nan if none is within tolerance
+    """
+    if is_valid_pixel(track_dict, rownum, colnum):
+        return rownum, colnum;
+    mask = track_dict["valid_mask"];
+    ny, nx = np.shape(mask);
+    row0, row1 = max(0, rownum - max_pixels), min(ny, rownum + max_pixels + 1);
+    col0, col1 = max(0, colnum - max_pixels), min(nx, colnum + max_pixels + 1);
+    valid_rows, valid_cols = np.nonzero(mask[row0:row1, col0:col1]);
+    if len(valid_rows) == 0:
+        return np.nan, np.nan;
+    distances = np.hypot(valid_rows + row0 - rownum, valid_cols + col0 - colnum);
+    best = np.argmin(distances);
+    if distances[best] > max_pixels:
+        return np.nan, np.nan;
+    return int(valid_rows[best] + row0), int(valid_cols[best] + col0);
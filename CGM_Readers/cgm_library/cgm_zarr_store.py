@@ -0,0 +1,289 @@
+"""
+Chunked directory store (Zarr version 2 layout) for CGM InSAR products, for many readers querying different regions.
+The store has the same groups, datasets, and attributes as the HDF5 file, with grids cut into compressed chunk
+files, so each query reads only the chunks it touches:
+
+test_SCEC_CGM_InSAR_v0_0_1.zarr/
+    ├── .zgroup, .zattrs
+    ├── .zmetadata  (consolidated metadata: every .zgroup, .zarray, and .zattrs of the store in one file)
+    ├── Product_Metadata/
+    └── Track_D071/
+        ├── Grid_Info/lon/0, Grid_Info/lkv_E/0.0, Grid_Info/lkv_E/0.1, ...
+        ├── Velocities/velocities/0.0, ...
+        └── Time_Series/20150121T134347/0.0, ...
+
+Grids keep the HDF5 orientation (north row first) and storage profile (float32 or quantized integers).
+Chunks are zlib-compressed, readable by the zarr package, but reading here only needs numpy.
+The readers in io_cgm_hdf5 accept a store directory wherever they accept an HDF5 file.
+"""
+
+import json
+import os
+import threading
+import zlib
+import h5py
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from . import io_cgm_hdf5
+
+CHUNK_SHAPE = (256, 256);
+COMPRESSOR = {"id": "zlib", "level": 1};
+SKIPPED_ATTRIBUTES = ["DIMENSION_LIST", "REFERENCE_LIST"];   # HDF5 object references, meaningless outside the file
+source_files = {};   # open HDF5 files in each export worker process
+
+
+def to_json_value(value):
+    """Convert an HDF5 attribute value into something json can write."""
+    if isinstance(value, bytes):
+        return value.decode();
+    if isinstance(value, np.ndarray):
+        return [to_json_value(x) for x in value.tolist()];
+    if isinstance(value, list):
+        return [to_json_value(x) for x in value];
+    if isinstance(value, np.generic):
+        return value.item();
+    return value;
+
+
+def get_attributes(h5_object):
+    """:return: dictionary of the json-compatible attributes of an h5py group or dataset"""
+    attributes = {};
+    for key in h5_object.attrs.keys():
+        if key not in SKIPPED_ATTRIBUTES:
+            attributes[key] = to_json_value(h5_object.attrs[key]);
+    return attributes;
+
+
+def get_array_metadata(dataset, chunk_shape):
+    """The .zarray metadata for one h5py dataset."""
+    chunks = [int(min(n, c)) for n, c in zip(dataset.shape, chunk_shape[-len(dataset.shape):])];
+    fill_value = dataset.fillvalue;
+    if np.issubdtype(dataset.dtype, np.floating):
+        fill_value = "NaN" if np.isnan(fill_value) else float(fill_value);
+    else:
+        fill_value = to_json_value(fill_value);
+    return {"zarr_format": 2, "shape": list(dataset.shape), "chunks": [max(c, 1) for c in chunks],
+            "dtype": dataset.dtype.str, "compressor": COMPRESSOR, "fill_value": fill_value, "order": "C",
+            "filters": None, "dimension_separator": "."};
+
+
+def get_chunk_indices(array_metadata):
+    """:return: list of chunk index tuples covering an array"""
+    counts = [-(-n // c) for n, c in zip(array_metadata["shape"], array_metadata["chunks"])];
+    return [tuple(int(x) for x in index) for index in np.ndindex(*counts)];
+
+
+def write_chunk(hdf_file, path, array_metadata, chunk_index, store_dir):
+    """
+    Copy one chunk of one dataset from the HDF5 file to the store. Runs in the export worker processes.
+    Edge chunks are padded with the fill value to the full chunk shape, as the Zarr layout requires.
+    """
+    if hdf_file not in source_files:
+        source_files[hdf_file] = io_cgm_hdf5.open_cgm_file(hdf_file);
+    dataset = source_files[hdf_file][path];
+    chunks = array_metadata["chunks"];
+    selection = tuple(slice(i * c, min((i + 1) * c, n)) for i, c, n in zip(chunk_index, chunks,
+                                                                            array_metadata["shape"]));
+    chunk = np.full(chunks, dataset.fillvalue, dtype=dataset.dtype);
+    data = dataset[selection];
+    chunk[tuple(slice(0, x) for x in np.shape(data))] = data;
+    with open(os.path.join(store_dir, path, ".".join(str(i) for i in chunk_index)), 'wb') as chunkfile:
+        chunkfile.write(zlib.compress(chunk.tobytes(), COMPRESSOR["level"]));
+    return;
+
+
+def write_chunk_task(args):
+    """Single-argument wrapper of write_chunk, for executor.map."""
+    return write_chunk(*args);
+
+
+def write_cgm_zarr(hdf_file, store_dir, chunk_shape=CHUNK_SHAPE, n_workers=4):
+    """
+    Export a CGM HDF5 file to a chunked directory store with consolidated metadata.
+
+    :param hdf_file: name of SCEC HDF5 File
+    :param store_dir: directory of the store (replaced chunk by chunk if it exists)
+    :param chunk_shape: (rows, columns) of each chunk; 1D datasets use the last value
+    :param n_workers: int, number of processes writing chunks in parallel
+    :return: the consolidated metadata dictionary
+    """
+    print("Writing chunked store %s from file %s " % (store_dir, hdf_file));
+    metadata, tasks = {}, [];
+    hf = io_cgm_hdf5.open_cgm_file(hdf_file);
+
+    def visit(name, h5_object):
+        os.makedirs(os.path.join(store_dir, name), exist_ok=True);
+        if isinstance(h5_object, h5py.Dataset):
+            array_metadata = get_array_metadata(h5_object, chunk_shape);
+            metadata[name + "/.zarray"] = array_metadata;
+            tasks.extend([(hdf_file, name, array_metadata, index, store_dir)
+                          for index in get_chunk_indices(array_metadata)]);
+        else:
+            metadata[name + "/.zgroup"] = {"zarr_format": 2};
+        metadata[name + "/.zattrs"] = get_attributes(h5_object);
+
+    metadata[".zgroup"] = {"zarr_format": 2};
+    metadata[".zattrs"] = get_attributes(hf);
+    os.makedirs(store_dir, exist_ok=True);
+    hf.visititems(visit);
+    hf.close();
+
+    for key, value in metadata.items():
+        with open(os.path.join(store_dir, key), 'w') as metafile:
+            json.dump(value, metafile);
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            list(executor.map(write_chunk_task, tasks, chunksize=max(1, len(tasks) // (4 * n_workers))));
+    else:
+        for task in tasks:
+            write_chunk(*task);
+    consolidated = {"zarr_consolidated_format": 1, "metadata": metadata};
+    with open(os.path.join(store_dir, ".zmetadata"), 'w') as metafile:
+        json.dump(consolidated, metafile);
+    print("Wrote %d chunks " % len(tasks));
+    return consolidated;
+
+
+def is_cgm_zarr(filename):
+    """True if filename is a chunked directory store rather than an HDF5 file."""
+    return os.path.isdir(filename) and os.path.isfile(os.path.join(filename, ".zmetadata"));
+
+
+def open_cgm_zarr(store_dir):
+    """
+    Open a chunked store for reading, from its consolidated metadata alone.
+
+    :param store_dir: directory of the store
+    :return: ZarrGroup for the root, used like an open h5py.File
+    """
+    with open(os.path.join(store_dir, ".zmetadata"), 'r') as metafile:
+        metadata = json.load(metafile)["metadata"];
+    return ZarrGroup(store_dir, "", metadata);
+
+
+class ZarrGroup:
+    """
+    Read-only group of a chunked store, with the parts of the h5py.Group interface that the CGM readers use
+    (keys, get, [], in, attrs, name).
+    """
+
+    def __init__(self, store_dir, path, metadata):
+        self.store_dir = store_dir;
+        self.path = path;
+        self.metadata = metadata;
+        self.attrs = metadata.get(self.join(".zattrs"), {});
+        self.name = "/" + path;
+
+    def join(self, key):
+        return key if self.path == "" else self.path + "/" + key;
+
+    def keys(self):
+        children = set();
+        for key in self.metadata.keys():
+            parts = key.split("/");
+            if len(parts) >= 2 and "/".join(parts[:-2]) == self.path and parts[-1] in [".zgroup", ".zarray"]:
+                children.add(parts[-2]);
+        return sorted(children);
+
+    def get(self, key):
+        path = self.join(key.strip("/"));
+        if path + "/.zgroup" in self.metadata:
+            return ZarrGroup(self.store_dir, path, self.metadata);
+        if path + "/.zarray" in self.metadata:
+            return ZarrArray(self.store_dir, path, self.metadata);
+        return None;
+
+    def __getitem__(self, key):
+        item = self.get(key);
+        if item is None:
+            raise KeyError(key);
+        return item;
+
+    def __contains__(self, key):
+        return self.get(key) is not None;
+
+    def close(self):
+        return;
+
+
+class ZarrArray:
+    """
+    Read-only array of a chunked store, with the parts of the h5py.Dataset interface that the CGM readers use
+    (shape, dtype, attrs, name, fillvalue, slicing, np.array). Slicing reads and decompresses only the chunks that
+    the selection touches, keeping recently used chunks in a small cache (safe to share between threads).
+    """
+
+    def __init__(self, store_dir, path, metadata, cache_size=64):
+        self.store_dir = store_dir;
+        self.path = path;
+        self.attrs = metadata.get(path + "/.zattrs", {});
+        self.name = "/" + path;
+        array_metadata = metadata[path + "/.zarray"];
+        self.shape = tuple(array_metadata["shape"]);
+        self.ndim = len(self.shape);
+        self.chunks = tuple(array_metadata["chunks"]);
+        self.dtype = np.dtype(array_metadata["dtype"]);
+        self.fillvalue = np.nan if array_metadata["fill_value"] == "NaN" else array_metadata["fill_value"];
+        self.cache = OrderedDict();
+        self.cache_size = cache_size;
+        self.cache_lock = threading.Lock();
+
+    def read_chunk(self, chunk_index):
+        """:return: one decompressed chunk (full chunk shape), from the cache when possible"""
+        with self.cache_lock:
+            if chunk_index in self.cache:
+                self.cache.move_to_end(chunk_index);
+                return self.cache[chunk_index];
+        filename = os.path.join(self.store_dir, self.path, ".".join(str(i) for i in chunk_index));
+        if os.path.isfile(filename):
+            with open(filename, 'rb') as chunkfile:
+                chunk = np.frombuffer(zlib.decompress(chunkfile.read()), dtype=self.dtype).reshape(self.chunks);
+        else:
+            chunk = np.full(self.chunks, self.fillvalue, dtype=self.dtype);   # chunks never written
+        with self.cache_lock:
+            self.cache[chunk_index] = chunk;
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False);
+        return chunk;
+
+    def __getitem__(self, selection):
+        """Basic numpy indexing: integers and slices, one per dimension (missing dimensions mean everything)."""
+        if selection is Ellipsis:
+            selection = ();
+        selection = selection if isinstance(selection, tuple) else (selection,);
+        selection = selection + (slice(None),) * (self.ndim - len(selection));
+        bounds, local = [], [];
+        for item, n in zip(selection, self.shape):
+            if isinstance(item, slice):
+                start, stop, step = item.indices(n);
+                indices = range(start, stop, step);
+                lo, hi = (min(indices), max(indices) + 1) if len(indices) > 0 else (0, 0);
+                bounds.append((lo, hi));
+                local_stop = stop - lo if stop - lo >= 0 else None;
+                local.append(slice(start - lo, local_stop, step) if len(indices) > 0 else slice(0, 0));
+            else:
+                index = int(item) + n if int(item) < 0 else int(item);
+                if not 0 <= index < n:
+                    raise IndexError("index %d is out of bounds for size %d" % (item, n));
+                bounds.append((index, index + 1));
+                local.append(0);
+        block = np.empty([hi - lo for lo, hi in bounds], dtype=self.dtype);
+        chunk_ranges = [range(lo // c, -(-hi // c)) for (lo, hi), c in zip(bounds, self.chunks)];
+        for chunk_index in np.ndindex(*[len(r) for r in chunk_ranges]):
+            chunk_index = tuple(r[i] for r, i in zip(chunk_ranges, chunk_index));
+            chunk = self.read_chunk(chunk_index);
+            source, target = [], [];
+            for i, (lo, hi), c in zip(chunk_index, bounds, self.chunks):
+                first, last = max(lo, i * c), min(hi, (i + 1) * c);
+                source.append(slice(first - i * c, last - i * c));
+                target.append(slice(first - lo, last - lo));
+            block[tuple(target)] = chunk[tuple(source)];
+        return block[tuple(local)];
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[()];
+        return data if dtype is None else data.astype(dtype);
+
+    def __len__(self):
+        return self.shape[0];
@@ -3,13 +3,18 @@ Library functions to generate a geoCSV file for each time-series pixel queried
 """
 
 from . import io_cgm_hdf5
+from . import cgm_valid_data
+from . import cgm_sampling
+from . import cgm_overviews
+from . import cgm_timeseries
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import datetime as dt
-import re
 import json
 
 
-def extract_csv_wrapper(hdf_file_list, pixel_list, output_dir):
+def extract_csv_wrapper(hdf_file_list, pixel_list, output_dir, snap_pixels=0, method="nearest", footprint=None,
+                        n_workers=1, return_failures=False):
     """
     Multiple-HDF5-File access function for sending multiple tracks, multiple pixels to GeoCSV.
     One track per geoCSV (we are not storing more than one look vector in GeoCSV header).
@@ -17,59 +22,129 @@ def extract_csv_wrapper(hdf_file_list, pixel_list, output_dir):
     :param hdf_file_list: name of one or several SCEC HDF5 Files, list
     :param pixel_list: list of structures [lon, lat]
     :param output_dir: directory where pixels' GeoCSVs will live
-    :returns: a list of pixel structures of metadata with velocity: [lon, lat, vel, lkv, track]
-    for convenient extracting of one pixel TS on the public website.
+    :param snap_pixels: int, snap pixels outside the valid-data domain to the nearest valid pixel within this
+    many pixels (0 means no snapping)
+    :param method: sampling method, 'nearest', 'bilinear', or 'area' (see cgm_sampling)
+    :param footprint: [width, height] in degrees of the averaging box for 'area' sampling
+    :param n_workers: int, number of processes extracting files in parallel (1 means one file after another)
+    :param return_failures: bool. If False, the first file that fails raises its exception. If True, files that fail
+    are skipped, and a list of [hdf_file, error message] is returned with the results.
+    :returns: a list of pixel structures of metadata with velocity: [lon, lat, vel, lkv, track, vel_unc]
+    for convenient extracting of one pixel TS on the public website. Results come in the order of hdf_file_list.
     """
-    pixel_structure_list = [];
-    for hdf_file in hdf_file_list:
-        pixel_structures = extract_csv_from_file(hdf_file, pixel_list, output_dir);
-        pixel_structure_list = pixel_structure_list + pixel_structures;
+    file_results, failures = map_over_files(extract_csv_from_file, hdf_file_list,
+                                            (pixel_list, output_dir, snap_pixels, method, footprint), n_workers,
+                                            return_failures);
+    pixel_structure_list = merge_file_results(file_results);
+    if return_failures:
+        return pixel_structure_list, failures;
     return pixel_structure_list;
 
 
-def extract_vels_wrapper(hdf_file_list, pixel_list):
+def extract_vels_wrapper(hdf_file_list, pixel_list, snap_pixels=0, method="nearest", footprint=None, n_workers=1,
+                         return_failures=False):
     """
     Multiple-HDF5-File access function for sending multiple tracks, multiple pixel velocities
     Pixel_list must have [lon, lat].
     :param hdf_file_list: name of one or several SCEC HDF5 Files, list
     :param pixel_list: list of structures [lon, lat]
-    :returns: velocity_list: list of velocities in mm/yr, look vectors, and track numbers.
-    ex: [lon, lat, 0.0, [lkvENU], 'D071']
+    :param snap_pixels: int, snap distance to the nearest valid pixel (0 means no snapping)
+    :param method: sampling method, 'nearest', 'bilinear', or 'area' (see cgm_sampling)
+    :param footprint: [width, height] in degrees of the averaging box for 'area' sampling
+    :param n_workers: int, number of processes extracting files in parallel (1 means one file after another)
+    :param return_failures: bool. If False, the first file that fails raises its exception. If True, files that fail
+    are skipped, and a list of [hdf_file, error message] is returned with the results.
+    :returns: velocity_list: list of velocities in mm/yr, look vectors, track numbers, and velocity uncertainties.
+    ex: [lon, lat, 0.0, [lkvENU], 'D071', nan]
     """
-    velocity_list = [];
-    for hdf_file in hdf_file_list:
-        velocity_list_one_track = extract_vel_from_file(hdf_file, pixel_list);
-        velocity_list = velocity_list + velocity_list_one_track;
+    file_results, failures = map_over_files(extract_vel_from_file, hdf_file_list,
+                                            (pixel_list, snap_pixels, method, footprint), n_workers, return_failures);
+    velocity_list = merge_file_results(file_results);
+    if return_failures:
+        return velocity_list, failures;
     return velocity_list;
 
 
-def extract_csv_from_file(hdf_file, pixel_list, output_dir):
+def map_over_files(function, hdf_file_list, args, n_workers=1, return_failures=False):
+    """
+    Run a single-file extraction function on every file, optionally in a process pool.
+    :param function: module-level function called as function(hdf_file, *args), returning a list
+    :param hdf_file_list: name of one or several SCEC HDF5 Files, list
+    :param args: tuple of the remaining arguments for function
+    :param n_workers: int, number of processes (1 runs in this process)
+    :param return_failures: bool. If False, the first file that fails (in file order) raises its exception.
+    If True, a file that fails is reported and skipped, without aborting the rest of the batch.
+    :returns: one result block per file, in the order of hdf_file_list (None for a file that failed),
+    and the failures, a list of [hdf_file, error message]
+    """
+    results, failures = [None for _ in hdf_file_list], [];
+    if n_workers <= 1 or len(hdf_file_list) <= 1:
+        for i, hdf_file in enumerate(hdf_file_list):
+            try:
+                results[i] = function(hdf_file, *args);
+            except Exception as e:
+                if not return_failures:
+                    raise;
+                print("Error: extraction from file %s failed: %s " % (hdf_file, e));
+                failures.append([hdf_file, repr(e)]);
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(hdf_file_list))) as pool:
+            futures = [pool.submit(function, hdf_file, *args) for hdf_file in hdf_file_list];
+            for i, future in enumerate(futures):
+                try:
+                    results[i] = future.result();
+                except Exception as e:
+                    if not return_failures:
+                        raise;
+                    print("Error: extraction from file %s failed: %s " % (hdf_file_list[i], e));
+                    failures.append([hdf_file_list[i], repr(e)]);
+    return results, failures;
+
+
+def merge_file_results(file_results):
+    """Concatenate the result blocks of map_over_files in file order, skipping files that failed."""
+    merged_list = [];
+    for one_result in file_results:
+        if one_result is not None:
+            merged_list.extend(one_result);
+    return merged_list;
+
+
+def extract_csv_from_file(hdf_file, pixel_list, output_dir, snap_pixels=0, method="nearest", footprint=None):
     """
     Single-HDF5-File access function: Write GeoCSVs for a list of one or more pixels.
     Pixel_list must have [lon, lat].
     :param hdf_file: name of SCEC HDF5 File
     :param pixel_list: list of structures [lon, lat]
     :param output_dir: directory where pixels' GeoCSVs will live
-    :returns: a list of pixel structures of metadata [lon, lat, vel, lkv, ]
+    :param snap_pixels: int, snap distance to the nearest valid pixel (0 means no snapping)
+    :param method: sampling method, 'nearest', 'bilinear', or 'area' (see cgm_sampling)
+    :param footprint: [width, height] in degrees of the averaging box for 'area' sampling
+    :returns: a list of pixel structures of metadata [lon, lat, vel, lkv, track, vel_unc]
     for convenient extracting of one pixel TS on the public website.
     """
-    cgm_data_structure = io_cgm_hdf5.read_cgm_hdf5_full_data(hdf_file);  # list of tracks
-    pixel_structures = extract_csv_from_cgm_data_structure(cgm_data_structure, pixel_list, output_dir);
+    cgm_data_structure = io_cgm_hdf5.read_cgm_hdf5_full_data(hdf_file, include_uncertainties=True);  # list of tracks
+    pixel_structures = extract_csv_from_cgm_data_structure(cgm_data_structure, pixel_list, output_dir, snap_pixels,
+                                                           method, footprint);
     # perform CSV write function
     return pixel_structures;
 
 
-def extract_vel_from_file(hdf_file, pixel_list):
+def extract_vel_from_file(hdf_file, pixel_list, snap_pixels=0, method="nearest", footprint=None):
     """
     Single-HDF5-File access function: get velocities for 1 or more pixels
     Pixel_list must have [lon, lat].
     :param hdf_file: name of SCEC HDF5 File
     :param pixel_list: list of structures [lon, lat]
-    :returns: velocity_list: list of velocities in mm/yr, look vectors, and track numbers.
-    ex: [lon, lat, 0.0, [lkvENU], 'D071']
+    :param snap_pixels: int, snap distance to the nearest valid pixel (0 means no snapping)
+    :param method: sampling method, 'nearest', 'bilinear', or 'area' (see cgm_sampling)
+    :param footprint: [width, height] in degrees of the averaging box for 'area' sampling
+    :returns: velocity_list: list of velocities in mm/yr, look vectors, track numbers, and velocity uncertainties.
+    ex: [lon, lat, 0.0, [lkvENU], 'D071', nan]
     """
     cgm_data_structure = io_cgm_hdf5.read_cgm_hdf5_full_data(hdf_file);  # list of tracks
-    velocity_list = extract_vel_from_cgm_data_structure(cgm_data_structure, pixel_list);
+    velocity_list = extract_vel_from_cgm_data_structure(cgm_data_structure, pixel_list, snap_pixels, method,
+                                                        footprint);
     return velocity_list;
 
 
@@ -84,8 +159,9 @@ def write_full_track_vels_to_csv(hdf_file, output_dir):
     track_dict = cgm_data_structure[0];  # take the first track, a safe assumption given we use 1-track-per-file
     bounding_box = [np.min(track_dict["lon"]), np.max(track_dict["lon"]),
                     np.min(track_dict["lat"]), np.max(track_dict["lat"])];
-    pixel_list, bounding_box_metadata = unpack_bounding_box(bounding_box);  # 1D list of pixels (each are [lon, lat])
-    velocity_list = extract_vel_from_cgm_data_structure(cgm_data_structure, pixel_list);
+    pixel_list, bounding_box_metadata = unpack_bounding_box(bounding_box, lon_array=track_dict["lon"],
+                                                            lat_array=track_dict["lat"]);  # 1D list of [lon, lat]
+    velocity_list = extract_vel_from_cgm_data_structure(cgm_data_structure, pixel_list, keep_invalid=True);
     write_vels_to_csv(velocity_list, output_dir);  # Then write to CSV
     return bounding_box_metadata;
 
@@ -99,8 +175,9 @@ def velocities_to_csv(hdf_file, bounding_box, output_dir):
     :returns: bounding box metadata, [W, E, S, N, nx, ny]
     """
     cgm_data_structure = io_cgm_hdf5.read_cgm_hdf5_full_data(hdf_file);  # list of tracks
-    pixel_list, bounding_box_metadata = unpack_bounding_box(bounding_box);  # 1D list of pixels (each are [lon, lat])
-    velocity_list = extract_vel_from_cgm_data_structure(cgm_data_structure, pixel_list);
+    pixel_list, bounding_box_metadata = unpack_bounding_box(bounding_box, lon_array=cgm_data_structure[0]["lon"],
+                                                            lat_array=cgm_data_structure[0]["lat"]);
+    velocity_list = extract_vel_from_cgm_data_structure(cgm_data_structure, pixel_list, keep_invalid=True);
     write_vels_to_csv(velocity_list, output_dir);  # Then write to CSV
     return bounding_box_metadata;
 
@@ -114,21 +191,33 @@ def velocities_to_json(hdf_file, bounding_box, output_dir):
     :returns: bounding box metadata [W, E, S, N, nx, ny]
     """
     cgm_data_structure = io_cgm_hdf5.read_cgm_hdf5_full_data(hdf_file);  # list of tracks
-    pixel_list, bounding_box_metadata = unpack_bounding_box(bounding_box);  # 1D list of pixels (each are [lon, lat])
-    velocity_list = extract_vel_from_cgm_data_structure(cgm_data_structure, pixel_list);
+    pixel_list, bounding_box_metadata = unpack_bounding_box(bounding_box, lon_array=cgm_data_structure[0]["lon"],
+                                                            lat_array=cgm_data_structure[0]["lat"]);
+    velocity_list = extract_vel_from_cgm_data_structure(cgm_data_structure, pixel_list, keep_invalid=True);
     write_vels_to_json(velocity_list, output_dir);  # Then write to JSON
     return bounding_box_metadata;
 
 
-def extract_vel_from_cgm_data_structure(cgm_data_structure, pixel_list):
+def extract_vel_from_cgm_data_structure(cgm_data_structure, pixel_list, snap_pixels=0, method="nearest",
+                                        footprint=None, keep_invalid=False):
     """
     get velocities for 1 or more pixels
     Pixel_list must have [lon, lat].
     :param cgm_data_structure: list of dictionaries
     :param pixel_list: list of structures [lon, lat]
-    :returns: velocity_list: list of velocities in mm/yr, look vectors, and track numbers.
-    ex: [lon, lat, 0.0, [lkvENU], 'D071']
+    :param snap_pixels: int, pixels outside the valid-data domain are moved to the nearest valid pixel within this
+    many pixels, if the file has a valid-data mask (0 means no snapping). Other invalid pixels are left out.
+    :param method: sampling method, 'nearest', 'bilinear', or 'area' (see cgm_sampling). Snapping only applies to
+    'nearest'; the other methods return the requested [lon, lat] instead of the nearest pixel's coordinates.
+    :param footprint: [width, height] in degrees of the averaging box for 'area' sampling
+    :param keep_invalid: bool, keep the pixels outside the valid-data domain (as nan rows) instead of leaving them
+    out, so that a grid of pixels comes back whole. Used by the bounding-box exports.
+    :returns: velocity_list: list of velocities in mm/yr, look vectors, track numbers, and velocity uncertainties
+    in mm/yr (nan for files without uncertainties).
+    ex: [lon, lat, 0.0, [lkvENU], 'D071', nan]
     """
+    if method != "nearest":
+        return extract_vel_sampled(cgm_data_structure, pixel_list, method, footprint);
     pixel_found_list, velocity_list = [], [];
     for pixel in pixel_list:
         # Find each track in data structure
@@ -139,42 +228,74 @@ def extract_vel_from_cgm_data_structure(cgm_data_structure, pixel_list):
             if np.isnan(rownum):
                 # print("Pixel", pixel, "is outside bounding box for track %s " % current_track);  # just logging
                 continue;  # pixel is outside bounding box of this track
+            valid_rownum, valid_colnum = cgm_valid_data.find_nearest_valid_pixel(track_dict, rownum, colnum,
+                                                                                 snap_pixels);
+            if not np.isnan(valid_rownum):
+                rownum, colnum = valid_rownum, valid_colnum;
+            elif not keep_invalid:
+                continue;  # pixel is outside valid data domain, and no valid pixel within snapping distance
 
             # Extract pixel time series data
-            [lon_found, lat_found, pixel_vel, lkv] = extract_pixel_vel(track_dict, rownum, colnum);
-            velocity_list.append([lon_found, lat_found, pixel_vel, lkv, current_track]);
+            [lon_found, lat_found, pixel_vel, lkv, pixel_vel_unc] = extract_pixel_vel(track_dict, rownum, colnum);
+            velocity_list.append([lon_found, lat_found, pixel_vel, lkv, current_track, pixel_vel_unc]);
     return velocity_list;
 
 
-def extract_csv_from_cgm_data_structure(cgm_data_structure, pixel_list, output_dir):
+def extract_csv_from_cgm_data_structure(cgm_data_structure, pixel_list, output_dir, snap_pixels=0, method="nearest",
+                                        footprint=None):
     """
     Writes GeoCSV. Pixel_list must have [lon, lat].
     :param cgm_data_structure: list of dictionaries
     :param pixel_list: list of structures [lon, lat]
     :param output_dir: directory where pixels' GeoCSVs will live
-    :returns: a list of pixel structures of metadata [lon, lat, vel, lkv, ]
+    :param snap_pixels: int, pixels outside the valid-data domain are moved to the nearest valid pixel within this
+    many pixels, if the file has a valid-data mask (0 means no snapping)
+    :param method: sampling method, 'nearest', 'bilinear', or 'area' (see cgm_sampling). Snapping only applies to
+    'nearest'.
+    :param footprint: [width, height] in degrees of the averaging box for 'area' sampling
+    :returns: a list of pixel structures of metadata [lon, lat, vel, lkv, track, vel_unc]
     for convenient extracting of one pixel TS on the public website.
     """
+    if method != "nearest":
+        return extract_csv_sampled(cgm_data_structure, pixel_list, output_dir, method, footprint);
+
+    # Find the pixels in each track, then read each track's time series for all its pixels at once
+    track_pixels = [];
+    for track_dict in cgm_data_structure:
+        rowcols = [];
+        for pixel in pixel_list:
+            rownum, colnum = get_nearest_rowcol(pixel, track_dict["lon"], track_dict["lat"]);
+            if not np.isnan(rownum):   # otherwise pixel is outside bounding box of this track
+                rownum, colnum = cgm_valid_data.find_nearest_valid_pixel(track_dict, rownum, colnum, snap_pixels);
+            rowcols.append((rownum, colnum));
+        found = [i for i in range(len(rowcols)) if not np.isnan(rowcols[i][0])];
+        dates, ts_matrix, unc_matrix = cgm_timeseries.extract_ts_matrix(track_dict, [rowcols[i][0] for i in found],
+                                                                       [rowcols[i][1] for i in found]);
+        matrix_row = dict([(i, k) for k, i in enumerate(found)]);
+        track_pixels.append((rowcols, matrix_row, dates, ts_matrix, unc_matrix));
+
     pixel_structures = [];
-    for pixel in pixel_list:
+    for i, pixel in enumerate(pixel_list):
 
         # Find each track in hdf5 file
-        for track_dict in cgm_data_structure:
+        for track_dict, (rowcols, matrix_row, dates, ts_matrix, unc_matrix) in zip(cgm_data_structure, track_pixels):
             current_track = track_dict["track_name"];
-            # Find nearest row and column in array
-            rownum, colnum = get_nearest_rowcol(pixel, track_dict["lon"], track_dict["lat"]);
-            if np.isnan(rownum):
+            if i not in matrix_row:
                 # print("Pixel", pixel, "is outside bounding box for track %s " % current_track);  # just logging
-                pixel_structures.append([]);   # error code for velocity out of bounds
-                continue;  # pixel is outside bounding box of this track
-
-            # Extract pixel time series data
-            pixel_time_series = extract_pixel_ts(track_dict, rownum, colnum);
-            pixel_lkv = [track_dict["lkv_E"][rownum][colnum],
-                         track_dict["lkv_N"][rownum][colnum],
-                         track_dict["lkv_U"][rownum][colnum]]
-            pixel_hgt = track_dict["dem"][rownum][colnum];
-            pixel_velocity = track_dict["velocities"][rownum][colnum];
+                pixel_structures.append([]);   # error code for out of bounds, or no data known from the mask alone
+                continue;  # pixel is outside bounding box or valid data domain of this track
+            rownum, colnum = rowcols[i];
+            k = matrix_row[i];
+
+            # Pixel time series data
+            pixel_unc = unc_matrix[k] if unc_matrix is not None else np.zeros(len(dates));  # GeoCSV: 0 if unknown
+            pixel_time_series = [dates, ts_matrix[k], pixel_unc];
+            pixel_lkv = [track_dict["lkv_E"][rownum, colnum],
+                         track_dict["lkv_N"][rownum, colnum],
+                         track_dict["lkv_U"][rownum, colnum]]
+            pixel_hgt = track_dict["dem"][rownum, colnum];
+            pixel_velocity = track_dict["velocities"][rownum, colnum];
+            pixel_vel_unc = track_dict["velo_unc"][rownum, colnum] if "velo_unc" in track_dict else np.nan;
             if np.sum(np.isnan(pixel_time_series[1])) == len(pixel_time_series[1]):   # if all values are np.nan
                 # print("Pixel", pixel, "is not in valid-data domain for track %s " % current_track);  # just logging
                 pixel_structures.append([]);  # error code for no velocity data
@@ -187,11 +308,80 @@ def extract_csv_from_cgm_data_structure(cgm_data_structure, pixel_list, output_d
             # print(pixel_lon_found, pixel_lat_found);   # debugging
             outfile = output_dir+"/pixel_"+str(pixel_lon_found)+"_"+str(pixel_lat_found)+"_"+str(current_track)+".csv";
             write_geocsv2p0(pixel_found, track_dict, pixel_time_series, pixel_lkv, pixel_hgt, outfile);  # write csv
-            pixel_metadata = [pixel_lon_found, pixel_lat_found, pixel_velocity, pixel_lkv, current_track];
+            pixel_metadata = [pixel_lon_found, pixel_lat_found, pixel_velocity, pixel_lkv, current_track,
+                              pixel_vel_unc];
             pixel_structures.append(pixel_metadata);   # save off pixel velocity and metadata
     return pixel_structures;
 
 
+def extract_vel_sampled(cgm_data_structure, pixel_list, method, footprint=None):
+    """
+    Get velocities for many pixels with bilinear or area-weighted sampling, vectorized over the pixels of each track.
+    :param cgm_data_structure: list of dictionaries
+    :param pixel_list: list of structures [lon, lat]
+    :param method: 'nearest', 'bilinear', or 'area'
+    :param footprint: [width, height] in degrees of the averaging box for 'area' sampling
+    :returns: velocity_list: same format as extract_vel_from_cgm_data_structure, with the requested [lon, lat]
+    """
+    track_samples = [];
+    for track_dict in cgm_data_structure:
+        sampler = cgm_sampling.build_sampler(track_dict["lon"], track_dict["lat"], pixel_list, method, footprint);
+        grids = ("velocities", "lkv_E", "lkv_N", "lkv_U") + (("velo_unc",) if "velo_unc" in track_dict else ());
+        samples = cgm_sampling.sample_track(track_dict, sampler, grids=grids);
+        track_samples.append((track_dict["track_name"], sampler["inside"], samples));
+    velocity_list = [];
+    for i, pixel in enumerate(pixel_list):
+        for current_track, inside, samples in track_samples:
+            if not inside[i]:
+                continue;  # pixel is outside bounding box of this track
+            lkv = [samples["lkv_E"][i], samples["lkv_N"][i], samples["lkv_U"][i]];
+            vel_unc = samples["velo_unc"][i] if "velo_unc" in samples else np.nan;
+            velocity_list.append([np.float64(pixel[0]), np.float64(pixel[1]), samples["velocities"][i], lkv,
+                                  current_track, vel_unc]);
+    return velocity_list;
+
+
+def extract_csv_sampled(cgm_data_structure, pixel_list, output_dir, method, footprint=None):
+    """
+    Writes GeoCSV with bilinear or area-weighted sampling, vectorized over the pixels of each track.
+    :param cgm_data_structure: list of dictionaries
+    :param pixel_list: list of structures [lon, lat]
+    :param output_dir: directory where pixels' GeoCSVs will live
+    :param method: 'nearest', 'bilinear', or 'area'
+    :param footprint: [width, height] in degrees of the averaging box for 'area' sampling
+    :returns: a list of pixel structures, same format as extract_csv_from_cgm_data_structure
+    """
+    track_samples = [];
+    for track_dict in cgm_data_structure:
+        sampler = cgm_sampling.build_sampler(track_dict["lon"], track_dict["lat"], pixel_list, method, footprint);
+        grids = ("velocities", "lkv_E", "lkv_N", "lkv_U", "dem") + (("velo_unc",) if "velo_unc" in track_dict else ());
+        samples = cgm_sampling.sample_track(track_dict, sampler, grids=grids);
+        date_keys, ts_matrix, unc_matrix = cgm_sampling.sample_time_series(track_dict, sampler);
+        _, dates_array = cgm_timeseries.get_ts_dates(track_dict);
+        if unc_matrix is None:
+            unc_matrix = np.zeros(np.shape(ts_matrix));   # the GeoCSV Std Dev LOS column has always used 0
+        track_samples.append((track_dict, sampler["inside"], samples, dates_array, ts_matrix, unc_matrix));
+
+    pixel_structures = [];
+    for i, pixel in enumerate(pixel_list):
+        for track_dict, inside, samples, dates_array, ts_matrix, unc_matrix in track_samples:
+            current_track = track_dict["track_name"];
+            if not inside[i] or np.all(np.isnan(ts_matrix[i])):
+                pixel_structures.append([]);  # error code for pixel outside bounding box or valid data domain
+                continue;
+            pixel_time_series = [dates_array, ts_matrix[i], unc_matrix[i]];
+            pixel_lkv = [samples["lkv_E"][i], samples["lkv_N"][i], samples["lkv_U"][i]];
+            pixel_lon_found = np.round(pixel[0], 3);
+            pixel_lat_found = np.round(pixel[1], 3);
+            outfile = output_dir+"/pixel_"+str(pixel_lon_found)+"_"+str(pixel_lat_found)+"_"+str(current_track)+".csv";
+            write_geocsv2p0([pixel[0], pixel[1]], track_dict, pixel_time_series, pixel_lkv, samples["dem"][i],
+                            outfile);
+            vel_unc = samples["velo_unc"][i] if "velo_unc" in samples else np.nan;
+            pixel_structures.append([pixel_lon_found, pixel_lat_found, samples["velocities"][i], pixel_lkv,
+                                     current_track, vel_unc]);
+    return pixel_structures;
+
+
 def get_nearest_rowcol(pixel, lon_array, lat_array):
     """
     :param pixel: [lon, lat]
@@ -210,14 +400,17 @@ def get_nearest_rowcol(pixel, lon_array, lat_array):
     return rownum, colnum;
 
 
-def unpack_bounding_box(bounding_box, xinc=0.002, yinc=0.002):
+def unpack_bounding_box(bounding_box, xinc=0.002, yinc=0.002, lon_array=None, lat_array=None):
     """
     Just a geometric function on a bounding box. xinc and yinc are in degrees
     Default xinc/yinc are same as default posting for cgm insar product
     We start on a valid InSAR pixel (rounded to odd increments of 0.002).
+    If a track's lon_array and lat_array are given, the spacing and alignment are taken from that grid instead.
     Returns a 1D list of pixels, in the form [lon, lat]
     Returns an expended bounding box metadata: [W, E, S, N, nx, ny]
     """
+    if lon_array is not None and lat_array is not None:
+        return unpack_bounding_box_on_grid(bounding_box, lon_array, lat_array);
     [w, e, s, n] = bounding_box;
     w = nearest_odd_thousanth(w, -0.001);
     e = nearest_odd_thousanth(e, 0.001);
@@ -232,6 +425,27 @@ def unpack_bounding_box(bounding_box, xinc=0.002, yinc=0.002):
     return pixel_list, expanded_bounding_box;
 
 
+def unpack_bounding_box_on_grid(bounding_box, lon_array, lat_array):
+    """
+    Like unpack_bounding_box, but pixels are aligned to an existing track grid with its own spacing.
+    Returns a 1D list of pixels, in the form [lon, lat]
+    Returns an expended bounding box metadata: [W, E, S, N, nx, ny]
+    """
+    [w, e, s, n] = bounding_box;
+    xinc, yinc = cgm_overviews.get_grid_spacing(lon_array, lat_array);
+    lon0, lat0 = lon_array[0], lat_array[0];
+    tol = 1e-6;   # fraction of a pixel, so that bounds sitting on a pixel center aren't moved by rounding error
+    first_col, last_col = int(np.floor((w - lon0) / xinc + tol)), int(np.ceil((e - lon0) / xinc - tol));
+    first_row, last_row = int(np.floor((s - lat0) / yinc + tol)), int(np.ceil((n - lat0) / yinc - tol));
+    lons = lon0 + xinc * np.arange(first_col, last_col);
+    lats = lat0 + yinc * np.arange(first_row, last_row);
+    X, Y = np.meshgrid(lons, lats);
+    pixel_list = [[x, y] for x, y in zip(X.ravel(), Y.ravel())];
+    expanded_bounding_box = [lon0 + xinc * first_col, lon0 + xinc * last_col, lat0 + yinc * first_row,
+                             lat0 + yinc * last_row, len(lons), len(lats)];
+    return pixel_list, expanded_bounding_box;
+
+
 def nearest_odd_thousanth(number, potential_offset):
     """Take an arbitrary number, and return the nearest InSAR pixel coordinate, given that pixels are every 0.002 on
     odd numbered thousanths"""
@@ -243,23 +457,17 @@ def nearest_odd_thousanth(number, potential_offset):
 
 def extract_pixel_ts(track_dict, rownum, colnum):
     """
-    Extract time series slice for a particular pixel
+    Extract time series slice for a particular pixel. For many pixels, cgm_timeseries.extract_ts_matrix returns
+    the same data as NumPy arrays, without Python objects per value.
     :param track_dict: data structure
     :param rownum: int
     :param colnum: int
-    :return: array of dates, array of numbers
+    :return: list of datetimes, list of numbers, list of uncertainties, in date order. Tracks without uncertainties
+    give 0, the value the GeoCSV Std Dev LOS column has always carried; cgm_timeseries.extract_ts_matrix returns None.
     """
-    dates_array, single_ts, single_unc = [], [], [];
-    for keyname in track_dict.keys():
-        if re.match(r"[0-9]{8}T[0-9]{6}", keyname):  # if we have time series slice, such as '20150121T134347'
-            dates_array.append(dt.datetime.strptime(keyname, "%Y%m%dT%H%M%S"));
-            single_ts.append(track_dict[keyname][rownum][colnum]);
-            single_unc.append(0);
-    # Put dates_array and single_time_series in proper chronological order
-    single_time_series = [x for _, x in sorted(zip(dates_array, single_ts))];
-    single_unc_series = [x for _, x in sorted(zip(dates_array, single_unc))];
-    dates_array = sorted(dates_array);
-    return [dates_array, single_time_series, single_unc_series];
+    dates, ts_matrix, unc_matrix = cgm_timeseries.extract_ts_matrix(track_dict, [rownum], [colnum]);
+    single_unc_series = list(unc_matrix[0]) if unc_matrix is not None else [0 for _ in dates];
+    return [list(dates.astype(dt.datetime)), list(ts_matrix[0]), single_unc_series];
 
 
 def extract_pixel_vel(track_dict, rownum, colnum):
@@ -268,22 +476,25 @@ def extract_pixel_vel(track_dict, rownum, colnum):
     :param track_dict: data structure
     :param rownum: int
     :param colnum: int
-    :return: lon, lat, velocity, array of [ENU] look vector
+    :return: lon, lat, velocity, array of [ENU] look vector, velocity uncertainty (nan if the track has none)
     """
     pixel_lon_found = np.round(track_dict["lon"][colnum], 3);  # nearest InSAR pixel
     pixel_lat_found = np.round(track_dict["lat"][rownum], 3);  # nearest InSAR pixel
-    velocity = track_dict["velocities"][rownum][colnum];
-    lkv_e = track_dict["lkv_E"][rownum][colnum]
-    lkv_n = track_dict["lkv_N"][rownum][colnum]
-    lkv_u = track_dict["lkv_U"][rownum][colnum]
-    return [pixel_lon_found, pixel_lat_found, velocity, [lkv_e, lkv_n, lkv_u]];
+    velocity = track_dict["velocities"][rownum, colnum];
+    lkv_e = track_dict["lkv_E"][rownum, colnum]
+    lkv_n = track_dict["lkv_N"][rownum, colnum]
+    lkv_u = track_dict["lkv_U"][rownum, colnum]
+    velocity_unc = track_dict["velo_unc"][rownum, colnum] if "velo_unc" in track_dict else np.nan;
+    return [pixel_lon_found, pixel_lat_found, velocity, [lkv_e, lkv_n, lkv_u], velocity_unc];
 
 
 def write_geocsv2p0(pixel, metadata_dictionary, pixel_time_series, lkv, pixel_hgt, outfile):
     """
     :param pixel: structure with [lon, lat]
     :param metadata_dictionary: a dictionary with many attributes
-    :param pixel_time_series: [list_of_dts, list_of_displacements, list_of_uncs]
+    :param pixel_time_series: [dates, displacements, uncertainties]. Dates can be datetimes or a datetime64 array
+    (from cgm_timeseries), and displacements and uncertainties lists or arrays. For tracks without uncertainties,
+    the extractors pass 0, which is what the Std Dev LOS column held before products had uncertainties.
     :param lkv: [lkv_e, lkv_n, lkv_u]
     :param pixel_hgt: height of target point on DEM
     :param outfile: name of file where csv will be stored
@@ -311,35 +522,39 @@ def write_geocsv2p0(pixel, metadata_dictionary, pixel_time_series, lkv, pixel_hg
     ofile.write("# Version: %s \n" % metadata_dictionary["version"]);
     ofile.write("# DOI: %s \n" % metadata_dictionary["doi"]);
     ofile.write("Datetime, LOS, Std Dev LOS\n");
-    for i in range(len(pixel_time_series[0])):
-        dt_string = dt.datetime.strftime(pixel_time_series[0][i], "%Y-%m-%dT%H:%M:%SZ");
-        ofile.write("%s, %f, %f\n" % (dt_string, pixel_time_series[1][i], pixel_time_series[2][i]) );
+    dt_strings = cgm_timeseries.dates_to_strings(pixel_time_series[0]);
+    for i in range(len(dt_strings)):
+        ofile.write("%s, %f, %f\n" % (dt_strings[i], pixel_time_series[1][i], pixel_time_series[2][i]) );
     ofile.close();
     return;
 
 
 def write_vels_to_csv(velocity_list, output_dir):
-    """Write pixels and their locations / velocities / Look vectors / tracks into a CSV file"""
+    """Write pixels and their locations / velocities / Look vectors / tracks into a CSV file.
+    Velocity uncertainty is written as nan for items without one (velocity lists from before uncertainties)."""
     if len(velocity_list) == 0:
         print("No pixels found. Not creating velocity csv. ");
         return;
     ofile = open(output_dir+"/velocity_list.csv", 'w');
-    ofile.write("# lon, lat, velocity(mm/yr), lkv_E, lkv_N, lkv_U, track\n");
+    ofile.write("# lon, lat, velocity(mm/yr), lkv_E, lkv_N, lkv_U, track, velocity_unc(mm/yr)\n");
     for item in velocity_list:
         ofile.write("%f, %f, " % (item[0], item[1]) );
-        ofile.write("%f, %f, %f, %f, %s\n" % (item[2], item[3][0], item[3][1], item[3][2], item[4]) );
+        vel_unc = item[5] if len(item) > 5 else np.nan;
+        ofile.write("%f, %f, %f, %f, %s, %f\n" % (item[2], item[3][0], item[3][1], item[3][2], item[4], vel_unc) );
     ofile.close();
     return;
 
 
 def write_vels_to_json(velocity_list, output_dir):
-    """Write pixels and their locations / velocities / Look vectors / tracks into a JSON file"""
+    """Write pixels and their locations / velocities / Look vectors / tracks into a JSON file.
+    Velocity uncertainty is written as NaN for items without one (velocity lists from before uncertainties)."""
     dictionary_list = [];
     for item in velocity_list:
         dictionary_list.append({"lon": item[0].astype(float), "lat": item[1].astype(float),
                                 "velocity": item[2].astype(float),
                                 "lkv_E": item[3][0].astype(float), "lkv_N": item[3][1].astype(float),
-                                "lkv_U": item[3][2].astype(float), "track": item[4]});
+                                "lkv_U": item[3][2].astype(float), "track": item[4],
+                                "velocity_unc": float(item[5]) if len(item) > 5 else np.nan});
     with open(output_dir+"/velocity_list.json", 'w') as fp:
         json.dump(dictionary_list, fp);
     return;
@@ -32,6 +32,12 @@ def write_empty_file_level_config(directory):
                                             "Materna, Kang Wang, Gareth Funning, David Bekaert, Michael Floyd, " \
                                             "Katherine Guns, Niloufar Abolfathian "
     genconfig["doi"] = "[future]"
+    genconfig["overview_levels"] = "2, 4, 8, 16"
+    genconfig["overview_time_series"] = "False"
+    genconfig["max_error_time_series"] = ""
+    genconfig["max_error_velocities"] = ""
+    genconfig["max_error_lkv"] = ""
+    genconfig["swmr_writes"] = "False"
 
     configobj["D071-config"] = {};
     trackconfig = configobj["D071-config"];
@@ -42,6 +48,8 @@ def write_empty_file_level_config(directory):
     trackconfig["safes_list"] = ""
     trackconfig["velocity_ll_grd"] = ""
     trackconfig["ts_directory"] = ""
+    trackconfig["velocity_unc_ll_grd"] = ""
+    trackconfig["ts_unc_directory"] = ""
     trackconfig["metadata_file"] = ""
     with open(directory+'/empty_file_level_config.txt', 'w') as configfile:
         configobj.write(configfile)
@@ -49,6 +57,28 @@ def write_empty_file_level_config(directory):
     return;
 
 
+def parse_overview_levels(general_config):
+    """Read the optional overview_levels field (like '2, 4, 8') into a list of ints. Empty means no overviews."""
+    levels_string = general_config.get("overview_levels", "");
+    return [int(x) for x in levels_string.replace(',', ' ').split()];
+
+
+def parse_max_abs_error(general_config):
+    """
+    Read the optional max_error_time_series, max_error_velocities, and max_error_lkv fields into the max_abs_error
+    dictionary of the quantized storage profile. Empty or missing fields mean float32 storage.
+    Raises ValueError for errors that aren't positive.
+    """
+    max_abs_error = {};
+    for key in ["time_series", "velocities", "lkv"]:
+        value = general_config.get("max_error_" + key, "");
+        if value.strip():
+            max_abs_error[key] = float(value);
+            if not max_abs_error[key] > 0:
+                raise ValueError("max_error_%s must be greater than 0, got %s" % (key, value));
+    return max_abs_error;
+
+
 def read_track_metadata_config(configfile):
     """Read a track metadata config into an object (works kind of like a dictinoary)"""
     print("Reading track metadata config file: ", configfile);
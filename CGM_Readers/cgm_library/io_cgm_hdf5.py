@@ -11,15 +11,27 @@ cgm_data_structure: a dictionary for each track:
     lkv_N : 2D array
     lkv_U : 2D array
     dem : 2D array
+    valid_mask : 2D boolean array (None for files written without a mask)
+    valid_bounds : [row_min, row_max, col_min, col_max] of valid data
     velocities : 2D array
+    velo_unc : 2D array (only for files with uncertainties)
     yyyymmddThhmmss (n time series slices)... : 2D arrays
+    unc_yyyymmddThhmmss (uncertainty of each time series slice)... : 2D arrays (only for files with uncertainties)
 }
+With lazy=True, the 2D grids other than valid_mask are LazyGrid objects that read from disk when indexed.
+Readers accept either an HDF5 file or a chunked directory store written by cgm_zarr_store.
 """
 
 import h5py, re
+import os
 from datetime import date
 import numpy as np
 from . import io_cgm_configs
+from . import cgm_valid_data
+from . import cgm_quantization
+from . import cgm_zarr_store
+from . import cgm_timeseries
+from . import cgm_overviews
 
 def read_cgm_hdf5_demo_python(input_filename):
     """
@@ -30,7 +42,7 @@ def read_cgm_hdf5_demo_python(input_filename):
     :return: Nothing, just prints metadata
     """
     print("\n\nReading hdf5 file %s in Python " % input_filename);
-    hf = h5py.File(input_filename, 'r');
+    hf = open_cgm_product(input_filename);
 
     # Print all available top levels:
     all_keys = [x for x in hf.keys()];  # returns a list of the top level directories
@@ -78,11 +90,141 @@ def read_cgm_hdf5_demo_python(input_filename):
     return None;
 
 
-def read_cgm_hdf5_full_data(input_filename):
+def summarize_cgm_product(input_filename):
+    """
+    Describe a product from its metadata alone, without reading any grids.
+
+    :param input_filename: an HDF5 file, or a chunked directory store
+    :return: dictionary with the product metadata and, for each track, its grid shape, time series dates,
+        quantized grids, and overview levels
+    """
+    hf = open_cgm_product(input_filename);
+    product_metadata = hf.get('Product_Metadata');
+    summary = {"filename": input_filename, "product_metadata": {}, "tracks": []};
+    for item in product_metadata.attrs.keys():
+        summary["product_metadata"][item] = str(product_metadata.attrs[item]);
+    all_keys = [x for x in hf.keys()];
+    all_keys.remove('Product_Metadata');
+    for track in all_keys:
+        track_data = hf.get(track);
+        grids = [track_data[x] for x in ["Grid_Info/lkv_E", "Grid_Info/lkv_N", "Grid_Info/lkv_U", "Grid_Info/dem",
+                                         "Velocities/velocities"] if x in track_data];
+        dates, n_uncertainties = [], 0;
+        if 'Velocities/velo_unc' in track_data:
+            grids.append(track_data['Velocities/velo_unc']);
+        if 'Time_Series' in track_data:
+            dates = sorted([x for x in track_data['Time_Series'].keys() if re.match(r"[0-9]{8}T[0-9]{6}", x)]);
+            grids = grids + [track_data['Time_Series'][x] for x in dates];
+            if 'Uncertainties' in track_data['Time_Series']:
+                n_uncertainties = len(track_data['Time_Series/Uncertainties'].keys());
+        publish_state = get_publish_state(track_data);
+        summary["tracks"].append({
+            "track_name": str(track_data.attrs["track_name"]),
+            "shape": [int(x) for x in grids[0].shape],
+            "has_velocities": 'Velocities' in track_data,
+            "has_velocity_uncertainties": 'Velocities/velo_unc' in track_data,
+            "n_time_series": len(dates),
+            "n_time_series_uncertainties": n_uncertainties,
+            "first_date": dates[0] if dates else None,
+            "last_date": dates[-1] if dates else None,
+            "quantized_grids": [x.name.split("/")[-1] for x in grids if cgm_quantization.is_quantized(x)],
+            "overview_levels": sorted([x for x in track_data['Overviews'].keys()]) if 'Overviews' in track_data
+            else [],
+            "published": True if publish_state is None else publish_state[1]});
+    hf.close();
+    return summary;
+
+
+def open_cgm_file(input_filename):
+    """
+    Open a CGM HDF5 file for reading. Opening in SWMR-read mode is harmless for ordinary files, and lets readers
+    see a consistent file while it is being written with write_cgm_hdf5(..., swmr=True).
+    """
+    return h5py.File(input_filename, 'r', swmr=True);
+
+
+def open_cgm_product(input_filename):
+    """
+    Open a CGM product for reading: an HDF5 file, or a chunked directory store (see cgm_zarr_store).
+    Both are used through the same group/dataset interface.
+    """
+    if cgm_zarr_store.is_cgm_zarr(input_filename):
+        return cgm_zarr_store.open_cgm_zarr(input_filename);
+    return open_cgm_file(input_filename);
+
+
+class LazyGrid:
+    """
+    A 2D grid of a track that stays on disk until indexed, for reading a few pixels from large products.
+    Indexes like the latitude-increasing arrays of read_cgm_hdf5_full_data (it handles the flip of the stored grid
+    and quantized storage), with integers and slices, or with two arrays of pixel rows and columns (which reads the
+    block that contains them). np.array(grid) reads the whole grid.
+    """
+
+    def __init__(self, dataset):
+        """:param dataset: h5py dataset or cgm_zarr_store.ZarrArray, stored north row first"""
+        self.dataset = dataset;
+        self.shape = tuple(dataset.shape);
+        self.ndim = 2;
+        self.dtype = np.dtype(np.float32) if cgm_quantization.is_quantized(dataset) else dataset.dtype;
+
+    def __getitem__(self, selection):
+        selection = selection if isinstance(selection, tuple) else (selection,);
+        rows, cols = selection + (slice(None),) * (2 - len(selection));
+        ny = self.shape[0];
+        if isinstance(rows, (list, np.ndarray)) and isinstance(cols, (list, np.ndarray)):
+            rows, cols = np.asarray(rows, dtype=int), np.asarray(cols, dtype=int);
+            if len(rows) == 0:
+                return np.zeros(0, dtype=self.dtype);
+            block = self[np.min(rows):np.max(rows)+1, np.min(cols):np.max(cols)+1];
+            return block[rows - np.min(rows), cols - np.min(cols)];
+        if isinstance(rows, slice):
+            start, stop, step = rows.indices(ny);
+            if step != 1:
+                return self[:, cols][rows];
+            block = cgm_quantization.read_grid(self.dataset, (slice(ny - max(stop, start), ny - start), cols));
+            return np.flipud(block);
+        rownum = int(rows) + ny if int(rows) < 0 else int(rows);
+        data = cgm_quantization.read_grid(self.dataset, (ny - 1 - rownum, cols));
+        return data[()] if np.ndim(data) == 0 else data;   # a single pixel comes back as a scalar, like NumPy
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[:, :];
+        return data if dtype is None else data.astype(dtype);
+
+    def __len__(self):
+        return self.shape[0];
+
+
+def get_publish_state(track_data):
+    """
+    For tracks written in SWMR mode: which datasets have been published so far.
+
+    :param track_data: h5py group for one track
+    :return: None for ordinary tracks, or [set of published dataset names, bool for whether the track is complete]
+    """
+    if 'publish_status' not in track_data.keys():
+        return None;
+    status = track_data['publish_status'];
+    flags = np.array(status);
+    paths = [x.decode() if isinstance(x, bytes) else str(x) for x in status.attrs["publish_paths"]];
+    published = set([path for path, flag in zip(paths[:-1], flags[:-1]) if flag]);
+    return [published, bool(flags[-1])];
+
+
+def read_cgm_hdf5_full_data(input_filename, include_partial_tracks=False, lazy=False, include_uncertainties=False):
     """
     Input function for HDF5 file of CGM working group with velocities and time series.
 
-    :param input_filename: an HDF5 file
+    :param input_filename: an HDF5 file, or a chunked directory store
+    :param include_partial_tracks: bool. For files being written in SWMR mode, tracks are normally returned only once
+        they are completely published. If True, tracks still being written are returned too, with only their
+        published time series slices (as long as their grids and velocities are published).
+    :param lazy: bool. If True, grids are LazyGrid objects and only the pixels that are indexed get read
+        (lon, lat, and the valid-data mask are read right away).
+    :param include_uncertainties: bool, whether to also read the time series uncertainty slices, as
+        "unc_" + yyyymmddThhmmss. They are as large as the time series itself, so they are only read on request.
+        The velocity uncertainty grid (velo_unc) is always read when the file has one.
     :return: internal data structure for the data in an hdf5 file.
         - one list element for each track (a dictionary for each track)
         - in each grid, the lon arrays increase from left to right, and lat arrays increase upward,
@@ -92,13 +234,25 @@ def read_cgm_hdf5_full_data(input_filename):
     """
     print("Reading file %s " % input_filename);
     cgm_data_structure = [];
-    hf = h5py.File(input_filename, 'r');
+    hf = open_cgm_product(input_filename);
+    if lazy:
+        read_2d_grid = LazyGrid;
+    else:
+        def read_2d_grid(dataset):
+            return np.flipud(cgm_quantization.read_grid(dataset));
     # Read each track in the hdf file
     product_metadata = hf.get("Product_Metadata");
     all_keys = [x for x in hf.keys()];  # returns a list of top level directories
     all_keys.remove('Product_Metadata');  # just loop through the keys that correspond to tracks of InSAR data
     for track in all_keys:
         track_data = hf.get(track);  # read from hdf5 file
+        publish_state = get_publish_state(track_data);
+        if publish_state is not None and not publish_state[1]:
+            core_grids = [track_data[x].name for x in ["Grid_Info/lkv_E", "Grid_Info/lkv_N", "Grid_Info/lkv_U",
+                                                       "Grid_Info/dem", "Velocities/velocities"] if x in track_data];
+            if not include_partial_tracks or not publish_state[0].issuperset(core_grids):
+                print("Skipping track %s: not yet published " % track_data.attrs["track_name"]);
+                continue;
 
         # Get metadata for track and for file, combined into one dictionary
         track_dict = {};  # the big dictionary for this track
@@ -112,20 +266,31 @@ def read_cgm_hdf5_full_data(input_filename):
         Grid_Info = track_data.get('Grid_Info');
         track_dict["lon"] = np.array(Grid_Info.get("lon"));
         track_dict["lat"] = np.array(Grid_Info.get("lat"));
-        track_dict["lkv_E"] = np.flipud(np.array(Grid_Info.get("lkv_E")));
-        track_dict["lkv_N"] = np.flipud(np.array(Grid_Info.get("lkv_N")));
-        track_dict["lkv_U"] = np.flipud(np.array(Grid_Info.get("lkv_U")));
-        track_dict["dem"] = np.flipud(np.array(Grid_Info.get("dem")));
+        track_dict["lkv_E"] = read_2d_grid(Grid_Info.get("lkv_E"));
+        track_dict["lkv_N"] = read_2d_grid(Grid_Info.get("lkv_N"));
+        track_dict["lkv_U"] = read_2d_grid(Grid_Info.get("lkv_U"));
+        track_dict["dem"] = read_2d_grid(Grid_Info.get("dem"));
+        track_dict["valid_mask"], track_dict["valid_bounds"] = cgm_valid_data.read_valid_mask(Grid_Info);
 
         # Get velocities: [2D_array_of_velocities]
         Velocities = track_data.get('Velocities');
-        track_dict["velocities"] = np.flipud(np.array(Velocities.get("velocities")));
+        track_dict["velocities"] = read_2d_grid(Velocities.get("velocities"));
+        if "velo_unc" in Velocities and (publish_state is None or Velocities["velo_unc"].name in publish_state[0]):
+            track_dict["velo_unc"] = read_2d_grid(Velocities.get("velo_unc"));
 
-        # Get time series: [2D_array_of_positions] for each time, if included in this file
+        # Get time series: [2D_array_of_positions] for each time, if included in this file, with uncertainties
         try:
             TS = track_data.get('Time_Series');
+            uncertainties = TS.get('Uncertainties') if include_uncertainties and 'Uncertainties' in TS else None;
             for item in TS.keys():
-                track_dict[item] = np.flipud(np.array(TS.get(item)));
+                if not re.match(r"[0-9]{8}T[0-9]{6}", item):
+                    continue;  # not a time series slice, such as the Uncertainties group
+                if publish_state is not None and TS.get(item).name not in publish_state[0]:
+                    continue;  # slice not yet published by an SWMR writer
+                track_dict[item] = read_2d_grid(TS.get(item));
+                if uncertainties is not None and item in uncertainties:
+                    if publish_state is None or uncertainties[item].name in publish_state[0]:
+                        track_dict[cgm_timeseries.UNCERTAINTY_PREFIX + item] = read_2d_grid(uncertainties[item]);
         except Exception:
             pass
 
@@ -134,24 +299,41 @@ def read_cgm_hdf5_full_data(input_filename):
 
 
 def write_cgm_hdf5(cgm_data_structure, configobj=None, output_filename="output.hdf5",
-                   write_velocities=True, write_time_series=True):
+                   write_velocities=True, write_time_series=True, max_abs_error=None, swmr=False,
+                   overview_levels=None, overview_time_series=False):
     """
     Output function to create HDF5 file from CGM working group's data.
     Useful for individuals who want to package their own data from a Python cgm_data_structure dictionary
 
     :param cgm_data_structure: a list of dictionaries
     :param configobj: configobj read from file-level config file (if not provided, read from the dictionary)
-    :param output_filename: the name of the HDF5 file that will be written.
+    :param output_filename: the name of the HDF5 file that will be written. The file is built as
+        output_filename + ".partial" and renamed into place when complete, so an existing product is never truncated
+        under its readers: they keep their consistent view of it, and new opens see the new file once it is finished.
+        Readers that want to follow an SWMR write while it happens open the .partial file.
     :param write_velocities: bool, whether to write velocities into the hdf5 file
     :param write_time_series: bool, whether to write time series into the hdf5 file
+    :param max_abs_error: optional quantized storage profile, a dictionary of maximum absolute errors for
+        "time_series" (mm), "velocities" (mm/yr), and "lkv" (unitless). Those grids are then stored as scaled
+        integers (see cgm_quantization). Missing keys or None mean float32 storage.
+    :param swmr: bool, single-writer/multiple-reader mode. All groups, attributes, and empty datasets are laid out
+        first; then the file switches to SWMR mode and grids are written and flushed one at a time, so that
+        readers (open_cgm_file) can open the file meanwhile. Each track has a publish_status dataset with one flag
+        per grid and a last flag that is set only after the whole track is flushed (its atomic publish step).
+    :param overview_levels: list of ints, block sizes of overview levels to build (see cgm_overviews), or None.
+        Overviews are laid out and published with the other grids, so they never need the file reopened for writing.
+    :param overview_time_series: bool, whether the overviews include each time series slice
     :type output_filename: string
     """
+    max_abs_error = {} if max_abs_error is None else max_abs_error;
     print("Writing file %s " % output_filename);
 
     if configobj is None:
         configobj = io_cgm_configs.build_config_dict(cgm_data_structure);
 
-    hf = h5py.File(output_filename, 'w');
+    partial_filename = output_filename + ".partial";
+    hf = h5py.File(partial_filename, 'w', libver='latest') if swmr else h5py.File(partial_filename, 'w');
+    tracks_pending = [];   # for swmr: [publish_status dataset, [(dataset, data), ...]] for each track
     prod_metadata = hf.create_group('Product_Metadata');  # create a metadata group
     prod_metadata.attrs['version'] = str(configobj["general-config"]["scec_cgm_version"]);
     prod_metadata.attrs['production_date'] = str(date.today());
@@ -166,6 +348,7 @@ def write_cgm_hdf5(cgm_data_structure, configobj=None, output_filename="output.h
 
     for track_dict in cgm_data_structure:
         print("Packaging track %s " % track_dict["track_name"]);
+        pending = [] if swmr else None;  # in swmr mode, grid data is written after the layout is complete
         track_data = hf.create_group('Track_'+track_dict["track_name"]);
         track_data.attrs["track_name"] = track_dict["track_name"];
         track_data.attrs["platform"] = track_dict["platform"];
@@ -200,43 +383,128 @@ def write_cgm_hdf5(cgm_data_structure, configobj=None, output_filename="output.h
         gmt_range = str(np.round(np.min(lon_array), 4))+'/'+str(np.round(np.max(lon_array), 4))+'/' + \
                     str(np.round(np.min(lat_array), 4))+'/'+str(np.round(np.max(lat_array), 4));
         grid_group.attrs["gmt_range"] = gmt_range;
-        tmp_e = grid_group.create_dataset('lkv_E', data=np.flipud(np.float32(track_dict["lkv_E"])));
+        tmp_e = create_grid_dataset(grid_group, 'lkv_E', track_dict["lkv_E"], max_abs_error.get("lkv"), pending);
         tmp_e.attrs["node_offset"] = 1;
         tmp_e.dims[1].attach_scale(lon_ds);
         tmp_e.dims[0].attach_scale(lat_ds);
-        tmp_n = grid_group.create_dataset('lkv_N', data=np.flipud(np.float32(track_dict["lkv_N"])));
+        tmp_n = create_grid_dataset(grid_group, 'lkv_N', track_dict["lkv_N"], max_abs_error.get("lkv"), pending);
         tmp_n.attrs["node_offset"] = 1;
         tmp_n.dims[1].attach_scale(lon_ds);
         tmp_n.dims[0].attach_scale(lat_ds);
-        tmp_u = grid_group.create_dataset('lkv_U', data=np.flipud(np.float32(track_dict["lkv_U"])));
+        tmp_u = create_grid_dataset(grid_group, 'lkv_U', track_dict["lkv_U"], max_abs_error.get("lkv"), pending);
         tmp_u.attrs["node_offset"] = 1;
         tmp_u.dims[1].attach_scale(lon_ds);
         tmp_u.dims[0].attach_scale(lat_ds);
-        tmp_dem = grid_group.create_dataset('dem', data=np.flipud(np.float32(track_dict["dem"])));
+        tmp_dem = create_grid_dataset(grid_group, 'dem', track_dict["dem"], None, pending);
         tmp_dem.attrs["node_offset"] = 1;
         tmp_dem.dims[1].attach_scale(lon_ds);
         tmp_dem.dims[0].attach_scale(lat_ds);
+        # Valid-data mask from all time series slices, so velocity-only files get the same domain
+        cgm_valid_data.write_valid_mask(grid_group, cgm_valid_data.compute_valid_mask(track_dict));
 
         # Package velocity information
         if write_velocities:
             vel_group = track_data.create_group('Velocities')
-            tmp = vel_group.create_dataset('velocities', data=np.flipud(np.float32(track_dict["velocities"])));
+            tmp = create_grid_dataset(vel_group, 'velocities', track_dict["velocities"],
+                                      max_abs_error.get("velocities"), pending);
             tmp.attrs["node_offset"] = 1;
             tmp.dims[1].attach_scale(lon_ds);
             tmp.dims[0].attach_scale(lat_ds);
             tmp.dims[0].label = 'latitude'
             tmp.dims[1].label = 'longitude'
+            if "velo_unc" in track_dict.keys():   # same storage profile as the velocities
+                tmp = create_grid_dataset(vel_group, 'velo_unc', track_dict["velo_unc"],
+                                          max_abs_error.get("velocities"), pending);
+                tmp.attrs["node_offset"] = 1;
+                tmp.dims[1].attach_scale(lon_ds);
+                tmp.dims[0].attach_scale(lat_ds);
 
         # Package time series information
         if write_time_series:
             ts_group = track_data.create_group('Time_Series');
+            unc_keys = [x for x in track_dict.keys() if x.startswith(cgm_timeseries.UNCERTAINTY_PREFIX)];
+            unc_group = ts_group.create_group('Uncertainties') if unc_keys else None;
             for keyname in track_dict.keys():
                 if re.match(r"[0-9]{8}T[0-9]{6}", keyname):  # if we have time series slice, such as '20150121T134347'
                     print("  time series: ", keyname);
-                    tmp = ts_group.create_dataset(keyname, data=np.flipud(np.float32(track_dict[keyname])));
+                    tmp = create_grid_dataset(ts_group, keyname, track_dict[keyname],
+                                              max_abs_error.get("time_series"), pending);
                     tmp.attrs["node_offset"] = 1;
                     tmp.dims[1].attach_scale(lon_ds);
                     tmp.dims[0].attach_scale(lat_ds);
+                    if cgm_timeseries.UNCERTAINTY_PREFIX + keyname in unc_keys:   # same profile as the slice
+                        tmp = create_grid_dataset(unc_group, keyname,
+                                                  track_dict[cgm_timeseries.UNCERTAINTY_PREFIX + keyname],
+                                                  max_abs_error.get("time_series"), pending);
+                        tmp.attrs["node_offset"] = 1;
+                        tmp.dims[1].attach_scale(lon_ds);
+                        tmp.dims[0].attach_scale(lat_ds);
+
+        # Package overviews, averaged from the in-memory grids
+        if overview_levels:
+            grids = [(name, '', track_dict[name]) for name in cgm_overviews.OVERVIEW_GRIDS.keys()
+                     if name in track_dict.keys() and (write_velocities or name != "velocities")];
+            if write_time_series and overview_time_series:
+                grids += [(keyname, 'Time_Series/', track_dict[keyname]) for keyname in track_dict.keys()
+                          if re.match(r"[0-9]{8}T[0-9]{6}", keyname)];
+            cgm_overviews.write_track_overviews(track_data, grids, overview_levels, pending);
+
+        if swmr:
+            status = track_data.create_dataset('publish_status', data=np.zeros(len(pending)+1, dtype=np.int8));
+            status.attrs["publish_paths"] = [dataset.name for dataset, _ in pending] + ["complete"];
+            tracks_pending.append([status, pending]);
 
+    if swmr:
+        publish_swmr_data(hf, tracks_pending);
     hf.close();
+    os.replace(partial_filename, output_filename);   # atomic on the same filesystem
     return;
+
+
+def publish_swmr_data(hf, tracks_pending):
+    """
+    Switch a laid-out file to SWMR mode, then write and flush each grid, flagging it as published.
+    A track's last publish flag is set only after all its grids are flushed.
+    """
+    hf.swmr_mode = True;
+    for status, pending in tracks_pending:
+        for i, (dataset, data) in enumerate(pending):
+            dataset[...] = data;
+            dataset.flush();
+            status[i] = 1;
+            status.flush();
+        status[-1] = 1;   # publish the completed track
+        status.flush();
+    return;
+
+
+def create_grid_dataset(group, name, grid, max_abs_error=None, pending=None):
+    """
+    Write one latitude-increasing 2D grid, flipped north-up on disk, as float32 or as quantized integers.
+
+    :param group: h5py group
+    :param name: name of the dataset
+    :param grid: 2D array
+    :param max_abs_error: float, maximum absolute error for quantized storage (None for float32)
+    :param pending: list, for swmr layout. If given, the dataset is created empty and (dataset, data) is appended.
+    :return: the h5py dataset
+    """
+    if max_abs_error is None:
+        data, fill_value = np.flipud(np.float32(grid)), np.float32(np.nan);
+    else:
+        quantized, scale_factor, add_offset, fill_value = cgm_quantization.quantize_grid(grid, max_abs_error);
+        data = np.flipud(quantized);
+    if pending is None:
+        dataset = group.create_dataset(name, data=data);
+    else:
+        dcpl = h5py.h5p.create(h5py.h5p.DATASET_CREATE);
+        dcpl.set_alloc_time(h5py.h5d.ALLOC_TIME_EARLY);  # no file-space allocation once readers are attached
+        dataset = group.create_dataset(name, shape=np.shape(data), dtype=data.dtype, fillvalue=fill_value, dcpl=dcpl);
+        pending.append((dataset, data));
+    if max_abs_error is None:
+        return dataset;
+    dataset.attrs["scale_factor"] = scale_factor;
+    dataset.attrs["add_offset"] = add_offset;
+    dataset.attrs["_FillValue"] = fill_value;
+    dataset.attrs["max_abs_error"] = max_abs_error;
+    return dataset;
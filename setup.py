@@ -34,6 +34,10 @@ setup(
     scripts=[
         'CGM_Readers/bin/cgm_generate_empty_configs.py',
         'CGM_Readers/bin/cgm_write_hdf5.py',
+        'CGM_Readers/bin/cgm_shared_cache.py',
     ],
+    entry_points={
+        'console_scripts': ['cgm = cgm_library.cgm_cli:main'],
+    },
     zip_safe=False,
 )